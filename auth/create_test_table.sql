@@ -0,0 +1,5 @@
+CREATE TABLE IF NOT EXISTS test_auth_otps (
+    email VARCHAR ( 255 ) PRIMARY KEY,
+    otp INTEGER NOT NULL,
+    expires_at TIMESTAMPTZ NOT NULL
+);
@@ -0,0 +1,3 @@
+INSERT INTO test_auth_otps(email, otp, expires_at)
+    VALUES ('testmail@gmail.com', 333222, CURRENT_TIMESTAMP + INTERVAL '5 minutes')
+    ON CONFLICT (email) DO UPDATE SET otp = EXCLUDED.otp, expires_at = EXCLUDED.expires_at;
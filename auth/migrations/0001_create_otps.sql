@@ -0,0 +1,8 @@
+-- One time passcodes, shared by every worker when AUTH_OTP_PERSIST=True
+CREATE TABLE IF NOT EXISTS auth_otps (
+    email VARCHAR ( 255 ) PRIMARY KEY,
+    otp INTEGER NOT NULL,
+    expires_at TIMESTAMPTZ NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS auth_otps_expires_at_idx ON auth_otps (expires_at);
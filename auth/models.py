@@ -0,0 +1,6 @@
+from pydantic import BaseModel
+
+
+class AuthUserPasscode(BaseModel):
+    username: str  # the user's email
+    otp: int
@@ -1,63 +1,381 @@
+"""One time passcodes and JWTs for passwordless login.
+
+Passcodes live in memory and expire through a heap ordered by expiry that is
+drained a little on every access, so there are no per key timers. With
+AUTH_OTP_PERSIST=True they are also written to Postgres, which lets any
+worker verify a passcode another one issued.
+
+Verified tokens are cached until they expire, so checking the same token on
+every request only pays for the signature verification once.
+
+Tokens are signed with AUTH_JWT_SECRET, which every worker and deploy must
+share; for asymmetric algorithms it holds the PEM private key and
+AUTH_JWT_PUBLIC_KEY the public one. Without it each process signs with a
+random secret of its own, and a warning is logged when it starts.
+"""
+from functools import lru_cache, partial
+from heapq import heappop, heappush
+from hmac import compare_digest
+from logging import Logger, getLogger
+from os import environ
+from secrets import randbelow, token_hex
+from threading import Lock
+from time import monotonic, time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
 from jwt import decode, encode
+from jwt.algorithms import get_default_algorithms
+from jwt.exceptions import InvalidTokenError
 
+from database.database import (
+    Query,
+    TableName,
+    Template,
+    compile_query,
+    from_table,
+    select,
+    where_constraint,
+)
+from users.models import User
+from users.service import UserNotFound, get_user_by_email
+from utils.cache import MISSING, TTLCache
 
-def get_otp(email: str):
+from .models import AuthUserPasscode
 
-    pass
+logger: Logger = getLogger(__name__)
+
+Passcode = int
+Claims = Dict[str, Any]
+
+otp_ttl: float = float(environ.get("AUTH_OTP_TTL", 300))
+otp_persist: bool = environ.get("AUTH_OTP_PERSIST", "False") == "True"
+
+jwt_algorithm: str = environ.get("AUTH_JWT_ALGORITHM", "HS256")
+jwt_secret: str = environ.get("AUTH_JWT_SECRET", "")
+if not jwt_secret:
+    # Tokens would only be valid in the process that made them
+    jwt_secret = token_hex(32)
+    if environ.get("TEST", "False") != "True":
+        logger.warning(
+            "AUTH_JWT_SECRET is not set: signing tokens with a random per process"
+            " secret, which other workers reject and a restart invalidates"
+        )
+# PEM public key, for asymmetric algorithms where AUTH_JWT_SECRET is private
+jwt_public_key: Optional[str] = environ.get("AUTH_JWT_PUBLIC_KEY")
+token_ttl: int = int(environ.get("AUTH_TOKEN_TTL", 3600))
 
+verified_tokens: TTLCache[str, Claims] = TTLCache(
+    int(environ.get("AUTH_TOKEN_CACHE_SIZE", 10_000)), token_ttl
+)
 
-def authenticate(req: AuthUserPasscode) -> bool:
+
+class InvalidPasscode(Exception):
     pass
 
 
-def generate_token():
+class InvalidToken(Exception):
     pass
 
 
-def create_otp(email: str):
+def otp_table() -> TableName:
+    return "test_auth_otps" if environ.get("TEST", "False") == "True" else "auth_otps"
 
-    pass
 
+def upsert_otp_query(table: TableName) -> Query:
+    return (
+        f"INSERT INTO {table} (email, otp, expires_at)"
+        " VALUES (%s, %s, CURRENT_TIMESTAMP + %s * INTERVAL '1 second')"
+        " ON CONFLICT (email) DO UPDATE"
+        " SET otp = EXCLUDED.otp, expires_at = EXCLUDED.expires_at"
+        " RETURNING email"
+    )
 
-def delete_otp(email):
-    pass
+
+def select_otp_query(table: TableName) -> Query:
+    """The passcode of an email and the seconds it has left to live."""
+    from_otps_table: Callable = from_table(table)
+    where_email_is_live: Callable = where_constraint(
+        ["email = %s", "expires_at > CURRENT_TIMESTAMP"]
+    )
+    return where_email_is_live(
+        from_otps_table(
+            select(["otp", "EXTRACT(EPOCH FROM expires_at - CURRENT_TIMESTAMP)"])
+        )
+    )
+
+
+def delete_otps_query(table: TableName) -> Query:
+    """DELETE of the passcodes of a list of emails."""
+    return f"DELETE FROM {table} WHERE email = ANY(%s) RETURNING email"
+
+
+def delete_expired_otps_query(table: TableName) -> Query:
+    return (
+        f"DELETE FROM {table}"
+        " WHERE email = ANY(%s) AND expires_at <= CURRENT_TIMESTAMP"
+        " RETURNING email"
+    )
+
+
+def consume_otp_query(table: TableName) -> Query:
+    return (
+        f"DELETE FROM {table}"
+        " WHERE email = %s AND otp = %s AND expires_at > CURRENT_TIMESTAMP"
+        " RETURNING email"
+    )
+
+
+def otp_template(name: str, build: Callable[[TableName], Query]) -> Template:
+    table: TableName = otp_table()
+    return compile_query(name, partial(build, table), table)
+
+
+class OTPStore:
+    """Passcodes by email that expire `ttl` seconds after they are set.
+
+    Every set pushes (expires_at, email) on a heap and every access pops the
+    entries that are due, so each passcode is expired exactly once and no
+    timer or scan is needed. A passcode replaced before it expires leaves a
+    stale heap entry behind, which is skipped when it is popped.
+    """
+
+    def __init__(self, ttl: float, persist: bool = False) -> None:
+        self.ttl = ttl
+        self.persist = persist
+        self._otps: Dict[str, Tuple[Passcode, float]] = {}
+        self._expiries: List[Tuple[float, str]] = []
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._otps)
+
+    def _expire(self) -> List[str]:
+        now: float = monotonic()
+        expired: List[str] = []
+        while self._expiries and self._expiries[0][0] <= now:
+            expires_at, email = heappop(self._expiries)
+            entry = self._otps.get(email)
+            if entry is not None and entry[1] == expires_at:
+                del self._otps[email]
+                expired.append(email)
+        return expired
+
+    def _remember(self, email: str, otp: Passcode, ttl: float) -> None:
+        expires_at: float = monotonic() + ttl
+        self._otps[email] = (otp, expires_at)
+        heappush(self._expiries, (expires_at, email))
+
+    def _purge(self, expired: List[str]) -> None:
+        # Rows this worker wrote are dropped when its heap says they are due
+        if self.persist and expired:
+            otp_template("delete_expired_otps", delete_expired_otps_query)((expired,))
+
+    def set(self, email: str, otp: Passcode) -> None:
+        if self.persist:
+            otp_template("upsert_otp", upsert_otp_query)((email, otp, self.ttl))
+        with self._lock:
+            expired: List[str] = self._expire()
+            self._remember(email, otp, self.ttl)
+        self._purge(expired)
+
+    def get(self, email: str) -> Optional[Passcode]:
+        with self._lock:
+            expired: List[str] = self._expire()
+            entry = self._otps.get(email)
+        self._purge(expired)
+        if entry is not None:
+            return entry[0]
+        if not self.persist:
+            return None
+
+        # Issued by another worker
+        rows = otp_template("select_otp", select_otp_query)((email,))
+        if not rows:
+            return None
+        otp, ttl = rows[0]
+        with self._lock:
+            self._remember(email, otp, float(ttl))
+        return otp
+
+    def delete(self, email: str) -> None:
+        with self._lock:
+            self._otps.pop(email, None)
+        if self.persist:
+            otp_template("delete_otps", delete_otps_query)(([email],))
+
+    def consume(self, email: str, otp: Passcode) -> bool:
+        """Delete the passcode of `email` if it is `otp`, telling whether it was.
+
+        With persistence the row is deleted conditionally, so a passcode can
+        only be used once across all workers.
+        """
+        if self.persist:
+            used: bool = bool(
+                otp_template("consume_otp", consume_otp_query)((email, otp))
+            )
+            with self._lock:
+                self._otps.pop(email, None)
+            return used
+
+        with self._lock:
+            self._expire()
+            entry = self._otps.get(email)
+            if entry is None or not compare_digest(str(entry[0]), str(otp)):
+                return False
+            del self._otps[email]
+            return True
+
+
+otp_store = OTPStore(otp_ttl, otp_persist)
+
+
+def get_otp(email: str) -> Optional[Passcode]:
+    return otp_store.get(email)
+
+
+def create_otp(email: str) -> Passcode:
+    otp: Passcode = 100_000 + randbelow(900_000)
+    otp_store.set(email, otp)
+    return otp
+
+
+def delete_otp(email: str) -> None:
+    otp_store.delete(email)
+
+
+@lru_cache(maxsize=None)
+def signing_key() -> Any:
+    """The signing key, parsed once rather than on every token."""
+    return get_default_algorithms()[jwt_algorithm].prepare_key(jwt_secret)
+
+
+@lru_cache(maxsize=None)
+def verifying_key() -> Any:
+    key: str = jwt_public_key or jwt_secret
+    return get_default_algorithms()[jwt_algorithm].prepare_key(key)
+
+
+def generate_token(user: User) -> str:
+    issued_at: int = int(time())
+    claims: Claims = {
+        "sub": str(user.id),
+        "user": {"id": user.id, "email": user.email, "fullname": user.fullname},
+        "iat": issued_at,
+        "exp": issued_at + token_ttl,
+    }
+    token: str = encode(claims, signing_key(), algorithm=jwt_algorithm)
+    verified_tokens.set(token, claims, token_ttl)
+    return token
+
+
+def decode_token(token: str) -> Claims:
+    claims = verified_tokens.get(token)
+    if claims is not MISSING:
+        return dict(claims)
+
+    try:
+        claims = decode(token, verifying_key(), algorithms=[jwt_algorithm])
+    except InvalidTokenError as err:
+        raise InvalidToken(str(err)) from err
+    # Cached no longer than the token is valid for
+    ttl: float = min(claims.get("exp", time()) - time(), verified_tokens.ttl)
+    if ttl > 0:
+        verified_tokens.set(token, claims, ttl)
+    return dict(claims)
+
+
+def validate_token(token: str) -> bool:
+    try:
+        decode_token(token)
+    except InvalidToken:
+        return False
+    return True
+
+
+def authenticate(req: AuthUserPasscode) -> str:
+    """Trade a valid passcode, which is used up, for a token."""
+    if not otp_store.consume(req.username, req.otp):
+        raise InvalidPasscode(f"Invalid passcode for {req.username}")
+    try:
+        user: User = get_user_by_email(req.username)
+    except UserNotFound as err:
+        raise InvalidPasscode(f"Invalid passcode for {req.username}") from err
+    return generate_token(user)
 
 
 if __name__ == "__main__":
 
-    from random import randint
+    from time import sleep
+
+    from utils.test_server import transactional
 
-    from requests import post
+    environ["TEST"] = "True"
+    otp_store = OTPStore(otp_ttl, persist=True)
 
-    email: strl = ("testmail@gmail.com",)
+    email: str = "testmail@gmail.com"
 
+    @transactional("auth")
     def _test_get_otp():
         test_otp = 333_222
         otp = get_otp(email)
         assert test_otp == otp
 
+    @transactional("auth")
     def _test_create_otp():
-        otp = create_otp(emali)
-        assert len(str(otp))
+        otp = create_otp(email)
+        assert len(str(otp)) == 6
+        otp_store._otps.clear()
         otp_from_db = get_otp(email)
         assert otp == otp_from_db
 
+    @transactional("auth")
+    def _test_delete_otp():
+        delete_otp(email)
+        assert get_otp(email) is None
+
+    def _test_otps_expire():
+        store = OTPStore(ttl=0.01)
+        store.set("a@a.com", 111_111)
+        store.set("b@b.com", 222_222)
+        store.set("a@a.com", 333_333)  # leaves a stale heap entry
+        sleep(0.02)
+        store.set("c@c.com", 444_444)
+        assert store.get("a@a.com") is None
+        assert len(store) == 1
+        assert len(store._expiries) == 1
+        assert not store.consume("c@c.com", 111_111)
+        assert store.consume("c@c.com", 444_444)
+        assert not store.consume("c@c.com", 444_444)
+
+    @transactional("users", "auth")
     def _test_auth_with_email():
-        email = ("testmail@gmail.com",)
-        otp = get_otp(email)
+        user_email = "testmail1@gmail.com"
+        passcode = create_otp(user_email)
 
-        auth_request = AuthUserPasscode(
-            username=email,
-            otp=passcode,
-        )
+        auth_request = AuthUserPasscode(username=user_email, otp=passcode)
 
         token = authenticate(auth_request)
         assert token != ""
         assert validate_token(token)
-        decoded_token = decode_token()
+        verified_tokens.clear()
+        decoded_token = decode_token(token)
         user = decoded_token["user"]
-        assert user["email"] == email
+        assert user["email"] == user_email
+        assert verified_tokens.get(token) is not MISSING
 
-    def _test_delete_otp():
-        delete_otp(email)
-        assert get_otp(email) is None
+        try:
+            authenticate(auth_request)
+        except InvalidPasscode:
+            pass
+        else:
+            raise Exception("Passcode was used twice")
+
+        assert not validate_token(token[:-2] + "xx")
+        expired = encode({"exp": int(time()) - 1}, signing_key(), jwt_algorithm)
+        assert not validate_token(expired)
+
+    _test_get_otp()
+    _test_create_otp()
+    _test_delete_otp()
+    _test_otps_expire()
+    _test_auth_with_email()
@@ -0,0 +1,206 @@
+"""Benchmark the users API.
+
+    python -m bench seed --users 1000000 --reset
+    python -m bench run --url http://127.0.0.1:8000 --concurrency 64
+    python -m bench compare bench/results/<old>.json bench/results/<new>.json
+    python -m bench serialize --rows 1000
+
+`run` drives every endpoint for --duration seconds each against a server
+that is already running, and writes RPS and p50/p95/p99 latencies to a JSON
+file named after the current commit. It exits with an error when any
+request failed, whether with a non 2xx status or with no answer.
+`serialize` times the encoding of a GET /users body in process, see
+bench/serialize.py.
+"""
+import os
+from argparse import ArgumentParser, Namespace
+from asyncio import run
+from datetime import datetime, timezone
+from json import dump, load
+from random import choice
+from subprocess import CalledProcessError, check_output
+from typing import Dict, List, Tuple
+from uuid import uuid4
+
+from bench.load import RequestFactory, Result, run_scenario
+from bench.seed import seed
+from bench.serialize import compare_serializers
+from database.database import connect, default_config
+from users.service import table_name
+
+scenarios: List[str] = ["list", "get", "post", "put", "delete"]
+
+
+def current_commit() -> str:
+    try:
+        return check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (CalledProcessError, OSError):
+        return "unknown"
+
+
+# Live ids the get, put and delete scenarios pick from, newest first
+max_ids: int = 100_000
+
+
+def live_users() -> Tuple[int, List[int]]:
+    """How many users are live, and the newest `max_ids` of their ids."""
+    table: str = table_name()
+    connection = connect(default_config)
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT COUNT(*) FROM {table} WHERE deleted_at IS NULL")
+            count: int = cursor.fetchone()[0]
+            cursor.execute(
+                f"SELECT id FROM {table} WHERE deleted_at IS NULL"
+                " ORDER BY id DESC LIMIT %s",
+                (max_ids,),
+            )
+            ids: List[int] = [row[0] for row in cursor.fetchall()]
+    finally:
+        connection.close()
+    if not ids:
+        raise SystemExit("No users to benchmark against, run `python -m bench seed`")
+    return count, ids
+
+
+def request_factory(scenario: str, ids: List[int], run_id: str) -> RequestFactory:
+    """Requests of `scenario` on the live `ids`.
+
+    Emails written by the benchmark are unique per run, scenario and request,
+    so no request fails on an email an earlier one took.
+    """
+
+    def user(n: int) -> dict:
+        return {
+            "fullname": f"bench_{run_id}_{scenario}_{n}",
+            "email": f"bench_{run_id}_{scenario}_{n}@example.com",
+            "phone_number": "15550000000",
+        }
+
+    factories: Dict[str, RequestFactory] = {
+        "list": lambda n: ("GET", "/users?limit=100", None),
+        "get": lambda n: ("GET", f"/users/{choice(ids)}", None),
+        "post": lambda n: ("POST", "/users", user(n)),
+        "put": lambda n: ("PUT", f"/users/{choice(ids)}", user(n)),
+        # Walk down from the newest id so every request deletes a live user
+        "delete": lambda n: ("DELETE", f"/users/{ids[(n - 1) % len(ids)]}", None),
+    }
+    return factories[scenario]
+
+
+def run_benchmarks(args: Namespace) -> None:
+    run_id: str = uuid4().hex[:8]
+    users, _ = live_users()
+    results: List[dict] = []
+    failed: List[str] = []
+    for scenario in args.scenarios:
+        # Read again for each scenario, the delete one takes users out
+        _, ids = live_users()
+        result: Result = run(
+            run_scenario(
+                scenario,
+                args.url,
+                request_factory(scenario, ids, run_id),
+                args.concurrency,
+                args.duration,
+            )
+        )
+        summary: dict = result.summary()
+        results.append(summary)
+        print(
+            "{scenario:>8}  {rps:>9} rps  p50 {p50_ms:>8} ms  p95 {p95_ms:>8} ms"
+            "  p99 {p99_ms:>8} ms  failures {failures}".format(**summary)
+        )
+        if result.failures:
+            failed.append(f"{scenario} {summary['statuses']}")
+
+    commit: str = current_commit()
+    output: str = args.output or os.path.join("bench", "results", f"{commit}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as file:
+        dump(
+            {
+                "commit": commit,
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "url": args.url,
+                "users": users,
+                "concurrency": args.concurrency,
+                "duration": args.duration,
+                "results": results,
+            },
+            file,
+            indent=2,
+        )
+    print(f"Results written to {output}")
+    # Numbers from failing requests measure the error path, not the endpoint
+    if failed:
+        raise SystemExit("Scenarios with failed requests: " + "; ".join(failed))
+
+
+def compare(args: Namespace) -> None:
+    with open(args.baseline) as file:
+        baseline: dict = load(file)
+    with open(args.candidate) as file:
+        candidate: dict = load(file)
+
+    before: Dict[str, dict] = {row["scenario"]: row for row in baseline["results"]}
+    print(f"{baseline['commit']} -> {candidate['commit']}")
+    for row in candidate["results"]:
+        old = before.get(row["scenario"])
+        if old is None:
+            continue
+        changes: List[str] = []
+        for metric in ("rps", "p50_ms", "p95_ms", "p99_ms"):
+            delta: float = (
+                (row[metric] - old[metric]) / old[metric] * 100 if old[metric] else 0
+            )
+            changes.append(f"{metric} {old[metric]} -> {row[metric]} ({delta:+.1f}%)")
+        print(f"{row['scenario']:>8}  " + "  ".join(changes))
+
+
+def serialize(args: Namespace) -> None:
+    costs: Dict[str, float] = compare_serializers(args.rows, args.repeat)
+    baseline: float = costs["jsonable_encoder"]
+    for name, cost in costs.items():
+        print(
+            f"{name:>16}  {cost * 1e6:8.2f} us/row  {baseline / cost:5.1f}x"
+            f"  {args.rows} rows in {cost * args.rows * 1000:.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Benchmark the users API")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    seed_parser = commands.add_parser("seed", help="insert synthetic users")
+    seed_parser.add_argument("--users", type=int, default=10_000)
+    seed_parser.add_argument("--reset", action="store_true", help="truncate first")
+
+    run_parser = commands.add_parser("run", help="load test a running server")
+    run_parser.add_argument("--url", default="http://127.0.0.1:8000")
+    run_parser.add_argument("--concurrency", type=int, default=32)
+    run_parser.add_argument("--duration", type=float, default=10)
+    run_parser.add_argument("--output", help="defaults to bench/results/<commit>.json")
+    run_parser.add_argument(
+        "--scenarios", nargs="+", choices=scenarios, default=scenarios
+    )
+
+    compare_parser = commands.add_parser("compare", help="diff two result files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("candidate")
+
+    serialize_parser = commands.add_parser(
+        "serialize", help="time GET /users body encoding in process"
+    )
+    serialize_parser.add_argument("--rows", type=int, default=1000)
+    serialize_parser.add_argument("--repeat", type=int, default=20)
+
+    args: Namespace = parser.parse_args()
+    if args.command == "seed":
+        print(f"Seeded {seed(args.users, args.reset)} users into {table_name()}")
+    elif args.command == "run":
+        run_benchmarks(args)
+    elif args.command == "serialize":
+        serialize(args)
+    else:
+        compare(args)
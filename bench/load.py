@@ -0,0 +1,154 @@
+"""Concurrent HTTP/1.1 load generator built on asyncio streams.
+
+Each worker keeps one keep-alive connection open and sends requests back to
+back for the duration of a scenario, so the numbers measure the server and
+not connection setup.
+"""
+from __future__ import annotations
+
+from asyncio import (
+    LimitOverrunError,
+    StreamReader,
+    StreamWriter,
+    gather,
+    get_running_loop,
+    open_connection,
+)
+from dataclasses import dataclass, field
+from json import dumps
+from time import perf_counter
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+Request = Tuple[str, str, Optional[dict]]  # method, path, json body
+RequestFactory = Callable[[int], Request]
+
+
+@dataclass
+class Result:
+    scenario: str
+    concurrency: int
+    duration: float
+    latencies: List[float] = field(default_factory=list)
+    statuses: Dict[int, int] = field(default_factory=dict)
+    errors: int = 0
+
+    @property
+    def failures(self) -> int:
+        """Requests answered with a non 2xx status or that got no answer."""
+        failed: int = sum(
+            n for status, n in self.statuses.items() if not 200 <= status < 300
+        )
+        return failed + self.errors
+
+    def percentile(self, pct: float) -> float:
+        if not self.latencies:
+            return 0.0
+        ordered: List[float] = sorted(self.latencies)
+        rank: int = max(0, int(round(pct / 100 * len(ordered))) - 1)
+        return ordered[rank]
+
+    def summary(self) -> dict:
+        return {
+            "scenario": self.scenario,
+            "concurrency": self.concurrency,
+            "duration": round(self.duration, 3),
+            "requests": len(self.latencies),
+            "rps": round(len(self.latencies) / self.duration, 1),
+            "p50_ms": round(self.percentile(50) * 1000, 3),
+            "p95_ms": round(self.percentile(95) * 1000, 3),
+            "p99_ms": round(self.percentile(99) * 1000, 3),
+            "statuses": {str(status): n for status, n in sorted(self.statuses.items())},
+            "errors": self.errors,
+            "failures": self.failures,
+        }
+
+
+class Connection:
+    def __init__(self, reader: StreamReader, writer: StreamWriter, host: str) -> None:
+        self.reader = reader
+        self.writer = writer
+        self.host = host
+
+    @classmethod
+    async def open(cls, host: str, port: int) -> Connection:
+        reader, writer = await open_connection(host, port)
+        return cls(reader, writer, host)
+
+    async def request(self, method: str, path: str, body: Optional[dict]) -> int:
+        payload: bytes = dumps(body).encode() if body is not None else b""
+        head: str = (
+            f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\n"
+            f"Content-Length: {len(payload)}\r\n"
+        )
+        if body is not None:
+            head += "Content-Type: application/json\r\n"
+        self.writer.write(head.encode() + b"\r\n" + payload)
+        await self.writer.drain()
+        return await self._read_response()
+
+    async def _read_response(self) -> int:
+        status: int = int((await self.reader.readuntil(b"\r\n")).split()[1])
+        headers: Dict[str, str] = {}
+        while True:
+            line: bytes = await self.reader.readuntil(b"\r\n")
+            if line == b"\r\n":
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if "content-length" in headers:
+            await self.reader.readexactly(int(headers["content-length"]))
+        elif headers.get("transfer-encoding") == "chunked":
+            while True:
+                size: int = int((await self.reader.readuntil(b"\r\n")).strip(), 16)
+                await self.reader.readexactly(size + 2)
+                if size == 0:
+                    break
+        return status
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+async def run_scenario(
+    scenario: str,
+    url: str,
+    make_request: RequestFactory,
+    concurrency: int,
+    duration: float,
+) -> Result:
+    """Drive `make_request(n)` from `concurrency` workers for `duration` seconds."""
+    target = urlsplit(url)
+    host: str = target.hostname or "127.0.0.1"
+    port: int = target.port or 80
+    result = Result(scenario=scenario, concurrency=concurrency, duration=duration)
+    counter: List[int] = [0]
+    deadline: float = get_running_loop().time() + duration
+
+    async def worker() -> None:
+        connection: Optional[Connection] = None
+        while get_running_loop().time() < deadline:
+            counter[0] += 1
+            method, path, body = make_request(counter[0])
+            started: float = perf_counter()
+            try:
+                if connection is None:
+                    connection = await Connection.open(host, port)
+                status: int = await connection.request(method, path, body)
+            except (OSError, ValueError, IndexError, EOFError, LimitOverrunError):
+                result.errors += 1
+                if connection is not None:
+                    connection.close()
+                connection = None
+                continue
+            result.latencies.append(perf_counter() - started)
+            result.statuses[status] = result.statuses.get(status, 0) + 1
+        if connection is not None:
+            connection.close()
+
+    started: float = perf_counter()
+    workers: List[Awaitable] = [worker() for _ in range(concurrency)]
+    await gather(*workers)
+    result.duration = perf_counter() - started
+    return result
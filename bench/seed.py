@@ -0,0 +1,40 @@
+"""Seed the users table with synthetic rows through COPY FROM STDIN."""
+from io import StringIO
+from typing import Iterator
+
+from database.database import connect, default_config
+from users.service import table_name
+from utils.migrate import migrate
+
+chunk_size: int = 100_000
+
+
+def fake_users(count: int, start: int = 0) -> Iterator[str]:
+    for idx in range(start, start + count):
+        yield f"bench_user_{idx}\t+1555{idx:07d}\tbench_user_{idx}@example.com\n"
+
+
+def seed(count: int, reset: bool = False) -> int:
+    """Insert `count` users, optionally truncating the table first."""
+    migrate()
+    table: str = table_name()
+    connection = connect(default_config)
+    try:
+        with connection.cursor() as cursor:
+            if reset:
+                cursor.execute(f"TRUNCATE {table} RESTART IDENTITY")
+            cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}")
+            start: int = cursor.fetchone()[0]
+
+            for offset in range(0, count, chunk_size):
+                rows = StringIO(
+                    "".join(fake_users(min(chunk_size, count - offset), start + offset))
+                )
+                cursor.copy_expert(
+                    f"COPY {table} (fullname, phone_number, email) FROM STDIN", rows
+                )
+            cursor.execute(f"ANALYZE {table}")
+        connection.commit()
+    finally:
+        connection.close()
+    return count
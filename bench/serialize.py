@@ -0,0 +1,63 @@
+"""Per-row cost of encoding a GET /users body, without a server or database.
+
+Compares the default FastAPI path (User and UserResponse objects through
+jsonable_encoder and JSONResponse) with UserRowsResponse, which encodes DB
+rows straight to JSON bytes.
+"""
+from datetime import datetime, timedelta, timezone
+from time import perf_counter
+from typing import Callable, Dict, List, Tuple
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from users.models import User, UserResponse
+from users.serializers import UserRowsResponse
+from users.service import user_fields
+
+Encoder = Callable[[List[Tuple]], bytes]
+
+
+def fake_rows(count: int) -> List[Tuple]:
+    created_at: datetime = datetime.now(timezone.utc)
+    values: List[Dict] = [
+        {
+            "id": idx,
+            "fullname": f"bench_user_{idx}",
+            "phone_number": f"+1555{idx:07d}",
+            "email": f"bench_user_{idx}@example.com",
+            "created_at": created_at - timedelta(seconds=idx),
+            "updated_at": None,
+            "deleted_at": None,
+        }
+        for idx in range(count)
+    ]
+    return [tuple(row[field] for field in user_fields) for row in values]
+
+
+def encode_models(rows: List[Tuple]) -> bytes:
+    users: List[UserResponse] = [UserResponse.from_model(User(*row)) for row in rows]
+    return JSONResponse(jsonable_encoder(users)).body
+
+
+def encode_rows(rows: List[Tuple]) -> bytes:
+    return UserRowsResponse(rows, user_fields).body
+
+
+encoders: Dict[str, Encoder] = {"jsonable_encoder": encode_models, "rows": encode_rows}
+
+
+def measure(encoder: Encoder, rows: List[Tuple], repeat: int) -> float:
+    """Best per-row time in seconds over `repeat` runs."""
+    best: float = float("inf")
+    for _ in range(repeat):
+        started: float = perf_counter()
+        encoder(rows)
+        best = min(best, perf_counter() - started)
+    return best / len(rows)
+
+
+def compare_serializers(rows: int, repeat: int) -> Dict[str, float]:
+    page: List[Tuple] = fake_rows(rows)
+    assert encode_models(page) == encode_rows(page), "serializers disagree"
+    return {name: measure(encoder, page, repeat) for name, encoder in encoders.items()}
@@ -1,13 +1,41 @@
 from __future__ import annotations
 
+from asyncio import AbstractEventLoop, Semaphore, get_running_loop
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
 from dataclasses import dataclass
+from functools import partial
 from os import environ
-from typing import Callable, List, Tuple, TypeVar
+from re import Match, Pattern
+from re import compile as compile_pattern
+from time import perf_counter
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Hashable,
+    Iterator,
+    List,
+    Sequence,
+    Tuple,
+    TypeVar,
+    Union,
+)
+from uuid import uuid4
+from weakref import WeakKeyDictionary
 
+from psycopg2 import Error as DriverError
+from psycopg2 import InterfaceError, OperationalError
 from psycopg2 import connect as driver
 from psycopg2.extensions import connection as Connection
 from psycopg2.extensions import cursor as Cursor
+from psycopg2.extras import execute_values
+
+from utils.metrics import Counter, Gauge, Histogram
+
+from .pool import Pool, default_pool_config
+from .replicas import ReplicaSet, mark_written, reads_from_primary, replica_reads
 
 
 class InvalidQuery(Exception):
@@ -30,20 +58,28 @@ TableName = str
 Query = str
 InsertValues = str
 UpdateValues = str
+Parameters = Tuple
+StatementName = str
 
 # Database Collections
 SelectFields = List[Field]
 WhereConstraints = List[str]
 QueryResult = List[Tuple]
+# One entry per inserted row, either its RETURNING row or the error it raised
+BulkResult = List[Union[Tuple, DriverError]]
 OrderConstraints = List[Tuple]
 
+# Builder Results: SQL with %s placeholders plus the values bound to them
+ValuesWithParameters = Tuple[str, Parameters]
+
 # Function Types
 AddValuesToQuery = Callable[[InsertValues], str]
 AddConstraintToQuery = Callable[[str], str]
-UpdateTable = Callable[[int], AddValuesToQuery]
-Executor = Callable[[Query], QueryResult]
+Executor = Callable[[Query, Parameters], QueryResult]
 FromTable = Callable[[TableName], Query]
 
+T = TypeVar("T")
+
 
 default_config = Config(
     db_name=environ.get("DB_NAME", "api"),
@@ -53,68 +89,454 @@ default_config = Config(
 )
 
 
+class PreparedConnection(Connection):
+    """Driver connection remembering which statements it has PREPAREd.
+
+    `prepared` maps each query shape to the EXECUTE statement that runs it.
+    Prepared statements belong to the session rather than to a transaction,
+    so they outlive rollbacks and the map stays valid for the connection.
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.prepared: Dict[Query, Query] = {}
+        self.prepared_count: int = 0
+
+
 def connect(config: Config) -> Connection:
     return driver(
         dbname=config.db_name,
         user=config.user,
         password=config.password,
         host=config.host,
+        connection_factory=PreparedConnection,
     )
 
 
-def update_table(table: TableName) -> UpdateTable:
-    return lambda item_id: (
-        lambda values: f"UPDATE {table} SET {values} WHERE id = {item_id} RETURNING id"
+default_pool = Pool(lambda: connect(default_config), default_pool_config)
+
+# Hot standbys of the primary, sharing its database name and credentials
+replica_configs: List[Config] = [
+    Config(
+        db_name=default_config.db_name,
+        user=default_config.user,
+        password=default_config.password,
+        host=host.strip(),
     )
+    for host in environ.get("DB_REPLICA_HOSTS", "").split(",")
+    if host.strip()
+]
+replicas = ReplicaSet(
+    [Pool(partial(connect, config), default_pool_config) for config in replica_configs],
+    # Seconds a replica that failed is left out before it is tried again
+    retry_after=float(environ.get("DB_REPLICA_RETRY_AFTER", 5)),
+)
 
+# Blocking driver calls run here so they never stall the event loop. It is
+# sized like the pool so a worker thread never waits on a checkout.
+executor_size: int = int(environ.get("DB_EXECUTOR_SIZE", default_pool_config.max_size))
+executor = ThreadPoolExecutor(max_workers=executor_size, thread_name_prefix="db")
+
+# Rows fetched per round trip by server-side cursors
+default_itersize: int = int(environ.get("DB_STREAM_ITERSIZE", 2000))
+
+# Rows sent per multi-row INSERT by bulk inserts
+default_batch_size: int = int(environ.get("DB_INSERT_BATCH_SIZE", 1000))
+
+_limiters: WeakKeyDictionary[AbstractEventLoop, Semaphore] = WeakKeyDictionary()
+
+_placeholder: Pattern = compile_pattern(r"%%|%s")
+
+# Query shape -> metrics label, filled in as templates are compiled
+statement_labels: Dict[Query, str] = {}
+
+query_duration = Histogram(
+    "db_query_duration_seconds",
+    "Database statement latency by statement shape",
+    ("statement",),
+)
+prepared_statements = Counter(
+    "db_prepared_statements_total", "Statements PREPAREd on a pooled connection"
+)
+Gauge(
+    "db_pool_connections",
+    "Pooled database connections by state",
+    lambda: {("idle",): default_pool.idle, ("in_use",): default_pool.in_use},
+    ("state",),
+)
+
+
+def update_table(table: TableName) -> AddValuesToQuery:
+    return lambda values: f"UPDATE {table} SET {values}"
 
-def update_values(item: Model) -> UpdateValues:
-    values_list: List[str] = [
-        f"{key} = '{value}'" if isinstance(value, str) else f"{key} = {value}"
-        for key, value in item.items()
-    ]
-    return ", ".join(values_list)
 
+def update_values(item: Model) -> ValuesWithParameters:
+    values_list: List[str] = [f"{key} = %s" for key in item]
+    return ", ".join(values_list), tuple(item.values())
 
-def insert_values(item: Model) -> InsertValues:
+
+def insert_values(item: Model) -> ValuesWithParameters:
     keys: str = ", ".join(list(item))
-    values: str = ""
-    for idx, value in enumerate(item.values()):
-        str_value = f"'{value}'" if isinstance(value, str) else str(value)
-        values += f"{str_value}" if idx == 0 else f", {str_value}"
-    return f"({keys}) VALUES ({values})"
+    values: str = ", ".join("%s" for _ in item)
+    return f"({keys}) VALUES ({values})", tuple(item.values())
 
 
 def insert_into(table: TableName) -> AddValuesToQuery:
     return lambda values: f"INSERT INTO {table}{values} RETURNING id"
 
 
+def to_positional(query: Query) -> Tuple[Query, int]:
+    """Rewrite %s placeholders as $1..$n for PREPARE, returning the count."""
+    count: int = 0
+
+    def replace(match: Match) -> str:
+        nonlocal count
+        if match.group() == "%%":
+            return "%"
+        count += 1
+        return f"${count}"
+
+    return _placeholder.sub(replace, query), count
+
+
+def prepare(connection: PreparedConnection, cursor: Cursor, query: Query) -> Query:
+    """PREPARE `query` once per connection and return the EXECUTE for it."""
+    execute: Query | None = connection.prepared.get(query)
+    if execute is not None:
+        return execute
+
+    positional_query, count = to_positional(query)
+    connection.prepared_count += 1
+    name: StatementName = f"stmt_{connection.prepared_count}"
+    cursor.execute(f"PREPARE {name} AS {positional_query}")
+    prepared_statements.inc()
+
+    execute = f"EXECUTE {name}"
+    if count > 0:
+        execute += " ({})".format(", ".join("%s" for _ in range(count)))
+    connection.prepared[query] = execute
+    return execute
+
+
 def query_executor(connection: Connection) -> Executor:
-    def executor(query: Query) -> QueryResult:
-        cursor: Cursor = connection.cursor()
-        cursor.execute(query)
-        return cursor.fetchall()
+    def executor(query: Query, params: Parameters = ()) -> QueryResult:
+        started: float = perf_counter()
+        try:
+            with connection.cursor() as cursor:
+                if isinstance(connection, PreparedConnection):
+                    cursor.execute(prepare(connection, cursor, query), params)
+                else:
+                    cursor.execute(query, params)
+                return cursor.fetchall()
+        finally:
+            query_duration.observe(
+                perf_counter() - started, statement_labels.get(query, "other")
+            )
+
+    return executor
+
+
+def bulk_insert_executor(connection: Connection) -> Callable[..., BulkResult]:
+    """Insert many rows with one multi-row INSERT per batch.
+
+    Each batch runs under a savepoint. When a batch fails it is replayed row
+    by row, each under its own savepoint, so one bad row only costs itself
+    and the caller learns which rows failed and why.
+    """
+
+    def executor(
+        table: TableName, rows: List[Model], batch_size: int = default_batch_size
+    ) -> BulkResult:
+        if not rows:
+            return []
+
+        keys: str = ", ".join(list(rows[0]))
+        values: str = ", ".join("%s" for _ in rows[0])
+        insert_batch: Query = f"INSERT INTO {table} ({keys}) VALUES %s RETURNING id"
+        insert_row: Query = (
+            f"INSERT INTO {table} ({keys}) VALUES ({values}) RETURNING id"
+        )
+
+        results: BulkResult = []
+        with connection.cursor() as cursor:
+            for start in range(0, len(rows), batch_size):
+                batch: List[Parameters] = [
+                    tuple(row.values()) for row in rows[start : start + batch_size]
+                ]
+                cursor.execute("SAVEPOINT bulk_insert")
+                try:
+                    results += execute_values(
+                        cursor, insert_batch, batch, page_size=len(batch), fetch=True
+                    )
+                    cursor.execute("RELEASE SAVEPOINT bulk_insert")
+                    continue
+                except DriverError:
+                    cursor.execute("ROLLBACK TO SAVEPOINT bulk_insert")
+
+                for params in batch:
+                    try:
+                        cursor.execute(insert_row, params)
+                    except DriverError as err:
+                        # The savepoint survives ROLLBACK TO and guards the next row
+                        cursor.execute("ROLLBACK TO SAVEPOINT bulk_insert")
+                        results.append(err)
+                        continue
+                    results.append(cursor.fetchone())
+                    cursor.execute("RELEASE SAVEPOINT bulk_insert")
+                    cursor.execute("SAVEPOINT bulk_insert")
+                cursor.execute("RELEASE SAVEPOINT bulk_insert")
+        return results
 
     return executor
 
 
-def query(query: Query) -> QueryResult:
-    connection: Connection = connect(default_config)
-    result: List[Tuple] = query_executor(connection)(query)
-    connection.commit()
+def _warm_up_pool(pool: Pool, queries: Sequence[Query]) -> int:
+    pool.open()
+    connections: List[Connection] = [pool.acquire() for _ in range(pool.idle)]
+    try:
+        for connection in connections:
+            try:
+                if isinstance(connection, PreparedConnection):
+                    with connection.cursor() as cursor:
+                        for statement in queries:
+                            prepare(connection, cursor, statement)
+                connection.commit()
+            except DriverError:
+                connection.rollback()
+                raise
+    finally:
+        for connection in connections:
+            pool.release(connection)
+    return len(connections)
+
+
+def warm_up(queries: Sequence[Query]) -> int:
+    """Open the pools and PREPARE `queries` on each of their connections.
+
+    Replicas only prepare the read-only queries. Returns how many connections
+    were warmed.
+    """
+    warmed: int = _warm_up_pool(default_pool, queries)
+    reads: List[Query] = [statement for statement in queries if is_read_only(statement)]
+    for pool in replicas.pools:
+        try:
+            warmed += _warm_up_pool(pool, reads)
+        except OperationalError:
+            replicas.mark_down(pool)
+    return warmed
+
+
+def shutdown() -> None:
+    """Wait for running database calls, then close every pooled connection."""
+    executor.shutdown(wait=True)
+    default_pool.close()
+    replicas.close()
+
+
+def is_read_only(query: Query) -> bool:
+    statement: str = query.lstrip().upper()
+    return statement.startswith("SELECT") and " FOR " not in statement
+
+
+def _execute(pool: Pool, query: Query, params: Parameters) -> QueryResult:
+    with pool.connection() as connection:
+        result: List[Tuple] = query_executor(connection)(query, params)
     return result
 
 
+def query(query: Query, params: Parameters = ()) -> QueryResult:
+    """Run `query` on the primary, which pins the current session to it."""
+    mark_written()
+    return _execute(default_pool, query, params)
+
+
+def reads_from_replicas() -> bool:
+    """Whether read-only statements of the current session may run on a replica."""
+    return bool(replicas.pools) and not reads_from_primary()
+
+
+def read_query(query: Query, params: Parameters = ()) -> QueryResult:
+    """Run a read-only `query` on a replica, or on the primary as a fallback."""
+    pool: Pool | None = None if reads_from_primary() else replicas.choose()
+    if pool is not None:
+        try:
+            result: QueryResult = _execute(pool, query, params)
+            replica_reads.inc("replica")
+            return result
+        except (OperationalError, InterfaceError):
+            replicas.mark_down(pool)
+    replica_reads.inc("primary")
+    return _execute(default_pool, query, params)
+
+
+@dataclass
+class Template:
+    """A query shape built once and executed many times through query(), or
+    read_query() when it only reads.
+
+    `calls` and `total_time` (seconds) accumulate without locking, so they can
+    drift slightly under heavy concurrency.
+    """
+
+    name: str
+    key: Tuple[Hashable, ...]
+    query: Query
+    read_only: bool = False
+    calls: int = 0
+    total_time: float = 0.0
+
+    @property
+    def label(self) -> str:
+        return ":".join([self.name, *(_label_part(part) for part in self.key)])
+
+    def __call__(self, params: Parameters = ()) -> QueryResult:
+        started: float = perf_counter()
+        try:
+            if self.read_only:
+                return read_query(self.query, params)
+            return query(self.query, params)
+        finally:
+            self.calls += 1
+            self.total_time += perf_counter() - started
+
+
+templates: Dict[Tuple[Hashable, ...], Template] = {}
+
+
+def _label_part(part: Hashable) -> str:
+    if isinstance(part, tuple):
+        return ",".join(str(item) for item in part)
+    return str(part)
+
+
+def compile_query(name: str, build: Callable[[], Query], *key: Hashable) -> Template:
+    """Return the template for (`name`, *`key`), building its SQL on first use.
+
+    `key` must capture everything `build` depends on, e.g. table and projection.
+    """
+    template: Template | None = templates.get((name, *key))
+    if template is None:
+        statement: Query = build()
+        template = templates.setdefault(
+            (name, *key),
+            Template(
+                name=name,
+                key=key,
+                query=statement,
+                read_only=is_read_only(statement),
+            ),
+        )
+        statement_labels.setdefault(template.query, template.label)
+    return template
+
+
+def template_stats() -> List[Dict[str, Any]]:
+    return [
+        {
+            "name": template.name,
+            "key": template.key,
+            "label": template.label,
+            "calls": template.calls,
+            "total_time": template.total_time,
+        }
+        for template in list(templates.values())
+    ]
+
+
+def _template_samples(stat: str) -> Callable[[], Dict[Tuple[str, ...], float]]:
+    return lambda: {(stats["label"],): stats[stat] for stats in template_stats()}
+
+
+Gauge(
+    "db_template_calls_total",
+    "Executions of each compiled query template",
+    _template_samples("calls"),
+    ("template",),
+    type="counter",
+)
+Gauge(
+    "db_template_seconds_total",
+    "Seconds spent executing each compiled query template",
+    _template_samples("total_time"),
+    ("template",),
+    type="counter",
+)
+
+
+def insert_many(
+    table: TableName, rows: List[Model], batch_size: int = default_batch_size
+) -> BulkResult:
+    """Insert `rows` (dicts sharing the same keys) in a single transaction."""
+    started: float = perf_counter()
+    mark_written()
+    with default_pool.connection() as connection:
+        result: BulkResult = bulk_insert_executor(connection)(table, rows, batch_size)
+    query_duration.observe(perf_counter() - started, f"insert_many:{table}")
+    return result
+
+
+def stream(
+    query: Query, params: Parameters = (), itersize: int = default_itersize
+) -> Iterator[Tuple]:
+    """Iterate over the result of `query` through a named (server-side) cursor.
+
+    Only `itersize` rows are held in memory at a time. The pooled connection
+    is kept until the iterator is exhausted or closed.
+    """
+    with default_pool.connection() as connection:
+        cursor: Cursor
+        with connection.cursor(name=f"stream_{uuid4().hex}") as cursor:
+            cursor.itersize = itersize
+            cursor.execute(query, params)
+            yield from cursor
+
+
+def _limiter() -> Semaphore:
+    loop: AbstractEventLoop = get_running_loop()
+    if loop not in _limiters:
+        _limiters[loop] = Semaphore(executor_size)
+    return _limiters[loop]
+
+
+async def run_async(blocking: Callable[..., T], *args: Any) -> T:
+    """Run a blocking database call on the executor.
+
+    Callers beyond the executor size queue on a semaphore in the event loop
+    instead of piling up in the executor's unbounded work queue.
+    """
+    async with _limiter():
+        # In the caller's context, so the call belongs to the caller's session
+        return await get_running_loop().run_in_executor(
+            executor, copy_context().run, partial(blocking, *args)
+        )
+
+
+async def query_async(statement: Query, params: Parameters = ()) -> QueryResult:
+    return await run_async(query, statement, params)
+
+
 def select(field_list: SelectFields) -> Query:
     return "SELECT {}".format(", ".join(field_list))
 
 
 def where_constraint(constraints: WhereConstraints) -> AddConstraintToQuery:
     return lambda query: "{query} WHERE {constraints}".format(
-        query=query, constraints="AND ".join(constraints)
+        query=query, constraints=" AND ".join(constraints)
     )
 
 
+def keyset_constraint(keys: SelectFields, descending: bool = True) -> str:
+    """Row comparison selecting the rows that sort after a bound row on `keys`.
+
+    The bound row's values are passed as parameters, in `keys` order. Meant to
+    be passed to where_constraint together with an ORDER BY on the same keys,
+    so a page fetch can walk an index instead of skipping rows.
+    """
+    operator: str = "<" if descending else ">"
+    values: str = ", ".join("%s" for _ in keys)
+    return f"({', '.join(keys)}) {operator} ({values})"
+
+
 def from_table(table: TableName) -> FromTable:
     return lambda query: f"{query} FROM {table}"
 
@@ -123,3 +545,12 @@ def order_by_constraint(order_by: OrderConstraints) -> AddConstraintToQuery:
     order_list: List[str] = [f"{order[0]} {order[1]}" for order in order_by]
     order: str = "ORDER BY {}".format(", ".join(order_list))
     return lambda query: f"{query} {order}"
+
+
+def returning(field_list: SelectFields) -> AddConstraintToQuery:
+    return lambda query: "{} RETURNING {}".format(query, ", ".join(field_list))
+
+
+def limit_constraint(query: Query) -> Query:
+    # The limit is a parameter so every page size shares one prepared statement
+    return f"{query} LIMIT %s"
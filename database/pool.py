@@ -0,0 +1,226 @@
+from __future__ import annotations
+
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from os import environ
+from threading import Condition
+from time import monotonic
+from typing import Callable, Deque, Dict, Iterator
+
+from psycopg2 import Error as DriverError
+from psycopg2.extensions import connection as Connection
+
+
+class PoolExhausted(Exception):
+    pass
+
+
+class PoolClosed(Exception):
+    pass
+
+
+@dataclass
+class PoolConfig:
+    min_size: int = 1
+    max_size: int = 10
+    # Seconds a connection above min_size may sit idle before it is closed
+    max_idle: float = 300.0
+    # Seconds after which a connection is recycled, whatever its state
+    max_lifetime: float = 3600.0
+    # Seconds a checkout waits for a free connection before giving up
+    checkout_timeout: float = 30.0
+    # Connections idle for longer than this are pinged before being handed out
+    health_check_after: float = 30.0
+
+
+@dataclass
+class _Entry:
+    connection: Connection
+    created_at: float = field(default_factory=monotonic)
+    last_used: float = field(default_factory=monotonic)
+
+
+ConnectionFactory = Callable[[], Connection]
+
+
+default_pool_config = PoolConfig(
+    min_size=int(environ.get("DB_POOL_MIN_SIZE", 1)),
+    max_size=int(environ.get("DB_POOL_MAX_SIZE", 10)),
+    max_idle=float(environ.get("DB_POOL_MAX_IDLE", 300)),
+    max_lifetime=float(environ.get("DB_POOL_MAX_LIFETIME", 3600)),
+    checkout_timeout=float(environ.get("DB_POOL_CHECKOUT_TIMEOUT", 30)),
+    health_check_after=float(environ.get("DB_POOL_HEALTH_CHECK_AFTER", 30)),
+)
+
+
+class Pool:
+    """Thread safe pool of driver connections.
+
+    Idle connections are reused most-recently-used first so the surplus above
+    `min_size` ages out and is reaped on the next checkout or release.
+    """
+
+    def __init__(self, factory: ConnectionFactory, config: PoolConfig) -> None:
+        self.factory = factory
+        self.config = config
+        self._idle: Deque[_Entry] = deque()
+        self._in_use: Dict[int, _Entry] = {}
+        self._size = 0
+        self._closed = False
+        self._lock = Condition()
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    @property
+    def idle(self) -> int:
+        return len(self._idle)
+
+    @property
+    def in_use(self) -> int:
+        return len(self._in_use)
+
+    def open(self) -> None:
+        """Eagerly open connections up to min_size."""
+        while True:
+            with self._lock:
+                if self._closed:
+                    raise PoolClosed("Pool is closed")
+                if self._size >= self.config.min_size:
+                    return
+                self._size += 1
+            entry = self._create()
+            with self._lock:
+                self._idle.append(entry)
+                self._lock.notify()
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            while self._idle:
+                self._discard(self._idle.popleft())
+            self._lock.notify_all()
+
+    def acquire(self) -> Connection:
+        deadline: float = monotonic() + self.config.checkout_timeout
+        while True:
+            entry = self._checkout(deadline)
+            if entry is None:
+                entry = self._create()
+            elif not self._healthy(entry):
+                with self._lock:
+                    self._discard(entry)
+                continue
+
+            with self._lock:
+                self._in_use[id(entry.connection)] = entry
+            return entry.connection
+
+    def release(self, connection: Connection, discard: bool = False) -> None:
+        with self._lock:
+            entry = self._in_use.pop(id(connection), None)
+            if entry is None:
+                connection.close()
+                return
+
+            if discard or self._closed or connection.closed or self._expired(entry):
+                self._discard(entry)
+            else:
+                entry.last_used = monotonic()
+                self._idle.append(entry)
+            self._reap()
+            self._lock.notify()
+
+    @contextmanager
+    def connection(self) -> Iterator[Connection]:
+        """Check out a connection, committing on success and rolling back on error."""
+        connection: Connection = self.acquire()
+        try:
+            yield connection
+        except BaseException:
+            self.release(connection, discard=not self._rollback(connection))
+            raise
+
+        try:
+            connection.commit()
+        except BaseException:
+            self.release(connection, discard=not self._rollback(connection))
+            raise
+        self.release(connection)
+
+    def _checkout(self, deadline: float) -> _Entry | None:
+        """Pop an idle entry, or reserve a slot for a new one (returns None)."""
+        with self._lock:
+            while True:
+                if self._closed:
+                    raise PoolClosed("Pool is closed")
+                self._reap()
+                if self._idle:
+                    return self._idle.pop()
+                if self._size < self.config.max_size:
+                    self._size += 1
+                    return None
+
+                remaining: float = deadline - monotonic()
+                if remaining <= 0:
+                    raise PoolExhausted(
+                        f"No connection available after {self.config.checkout_timeout}s"
+                    )
+                self._lock.wait(remaining)
+
+    def _create(self) -> _Entry:
+        try:
+            return _Entry(self.factory())
+        except BaseException:
+            with self._lock:
+                self._size -= 1
+                self._lock.notify()
+            raise
+
+    def _healthy(self, entry: _Entry) -> bool:
+        if entry.connection.closed or self._expired(entry):
+            return False
+        if monotonic() - entry.last_used < self.config.health_check_after:
+            return True
+        try:
+            with entry.connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            entry.connection.commit()
+        except DriverError:
+            return False
+        return True
+
+    def _expired(self, entry: _Entry) -> bool:
+        return monotonic() - entry.created_at >= self.config.max_lifetime
+
+    def _reap(self) -> None:
+        # Callers must hold the lock. Oldest idle entries sit on the left.
+        now: float = monotonic()
+        while self._idle:
+            entry = self._idle[0]
+            idle_for: float = now - entry.last_used
+            surplus: bool = self._size > self.config.min_size
+            if self._expired(entry) or (surplus and idle_for >= self.config.max_idle):
+                self._discard(self._idle.popleft())
+            else:
+                return
+
+    def _discard(self, entry: _Entry) -> None:
+        # Callers must hold the lock
+        self._size -= 1
+        try:
+            entry.connection.close()
+        except DriverError:
+            pass
+
+    @staticmethod
+    def _rollback(connection: Connection) -> bool:
+        if connection.closed:
+            return False
+        try:
+            connection.rollback()
+        except DriverError:
+            return False
+        return True
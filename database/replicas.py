@@ -0,0 +1,177 @@
+"""Routing of read-only statements to read replicas.
+
+Reads go to the healthy replica with the fewest connections checked out,
+ties taking turns. A replica whose connection fails is skipped for
+`retry_after` seconds, and reads fall back to the primary whenever no replica
+is configured or healthy.
+
+A session that has written reads from the primary from then on, so it sees
+its own writes whatever the replication lag. The context holds a mutable
+Session rather than a flag because statements run on executor threads, in
+copies of the context whose changes never reach the caller.
+"""
+from __future__ import annotations
+
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from dataclasses import dataclass
+from itertools import count
+from threading import Lock
+from time import monotonic
+from typing import Iterator, List, Optional, Sequence
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from utils.metrics import Counter
+
+from .pool import Pool
+
+replica_reads = Counter(
+    "db_replica_reads_total",
+    "Read-only statements by the server that ran them",
+    ("target",),
+)
+replica_failures = Counter(
+    "db_replica_failures_total",
+    "Replica connection failures that sent reads to the primary",
+    ("replica",),
+)
+
+
+@dataclass
+class Session:
+    wrote: bool = False
+
+
+session: ContextVar[Optional[Session]] = ContextVar("db_session", default=None)
+
+
+def begin_session() -> Token:
+    """Start a session in the current context, to be ended with session.reset()."""
+    return session.set(Session())
+
+
+def mark_written() -> None:
+    current: Optional[Session] = session.get()
+    if current is not None:
+        current.wrote = True
+
+
+def reads_from_primary() -> bool:
+    current: Optional[Session] = session.get()
+    return current is not None and current.wrote
+
+
+@contextmanager
+def primary_reads() -> Iterator[None]:
+    """Read from the primary within the block, as if the session had written."""
+    token: Token = session.set(Session(wrote=True))
+    try:
+        yield
+    finally:
+        session.reset(token)
+
+
+class SessionMiddleware:
+    """Give every request its own session, so its writes pin its reads."""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        token: Token = begin_session()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            session.reset(token)
+
+
+class ReplicaSet:
+    def __init__(self, pools: Sequence[Pool], retry_after: float) -> None:
+        self.pools: List[Pool] = list(pools)
+        self.retry_after = retry_after
+        self._down_until: List[float] = [0.0] * len(self.pools)
+        self._turns: Iterator[int] = count()
+        self._lock = Lock()
+
+    def choose(self) -> Optional[Pool]:
+        """The replica to read from, or None to read from the primary."""
+        if not self.pools:
+            return None
+        now: float = monotonic()
+        with self._lock:
+            start: int = next(self._turns)
+        healthy: List[Pool] = [
+            self.pools[index]
+            for index in (
+                (start + offset) % len(self.pools) for offset in range(len(self.pools))
+            )
+            if self._down_until[index] <= now
+        ]
+        if not healthy:
+            return None
+        # min() keeps the first of equally loaded replicas, which rotates
+        return min(healthy, key=lambda pool: pool.in_use)
+
+    def mark_down(self, pool: Pool) -> None:
+        index: int = self.pools.index(pool)
+        self._down_until[index] = monotonic() + self.retry_after
+        replica_failures.inc(str(index))
+
+    def close(self) -> None:
+        for pool in self.pools:
+            pool.close()
+
+
+if __name__ == "__main__":
+    from contextvars import copy_context
+    from threading import Thread
+
+    class _FakePool:
+        def __init__(self, in_use: int = 0) -> None:
+            self.in_use = in_use
+
+    def _test_choose():
+        first, second = _FakePool(), _FakePool()
+        replicas = ReplicaSet([first, second], retry_after=60)  # type: ignore
+        assert ReplicaSet([], retry_after=60).choose() is None
+        assert [replicas.choose() for _ in range(4)] == [first, second] * 2
+
+        second.in_use = 1
+        assert [replicas.choose() for _ in range(2)] == [first, first]
+
+        replicas.mark_down(first)
+        assert [replicas.choose() for _ in range(2)] == [second, second]
+        replicas.mark_down(second)
+        assert replicas.choose() is None
+        assert replica_failures.totals()[("0",)] == 1
+
+        replicas._down_until = [0.0, 0.0]
+        assert replicas.choose() is not None
+
+    def _test_writes_pin_the_session():
+        assert not reads_from_primary()
+        mark_written()  # no session: nothing to pin
+
+        token: Token = begin_session()
+        try:
+            assert not reads_from_primary()
+            # Writes run in a copy of the context, on another thread
+            worker = Thread(target=copy_context().run, args=(mark_written,))
+            worker.start()
+            worker.join()
+            assert reads_from_primary()
+        finally:
+            session.reset(token)
+        assert not reads_from_primary()
+
+        with primary_reads():
+            assert reads_from_primary()
+        assert not reads_from_primary()
+
+    _test_choose()
+    _test_writes_pin_the_session()
@@ -1,6 +1,64 @@
+from asyncio import Task, create_task, gather
+from logging import Logger, getLogger
+from typing import Optional
+
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 
+from database.database import run_async, shutdown, warm_up
+from database.replicas import SessionMiddleware
+from users.archive import archive_interval, archive_periodically
 from users.router import router as user_router
+from users.service import compile_user_queries, warm_user_cache
+from utils.metrics import MetricsMiddleware, render
+
+logger: Logger = getLogger("uvicorn.error")
 
 app = FastAPI()
+app.add_middleware(SessionMiddleware)
+app.add_middleware(MetricsMiddleware)
 app.include_router(user_router)
+
+
+@app.on_event("startup")
+async def warm_up_worker() -> None:
+    """Open connections, prepare statements and fill caches before serving.
+
+    The server only accepts connections once this returns. A warm up that
+    fails, on a database that is not reachable yet or on anything else, is
+    logged and leaves the worker cold instead of failing it.
+    """
+    queries = [template.query for template in compile_user_queries()]
+    try:
+        connections: int = await run_async(warm_up, queries)
+        users: int = await run_async(warm_user_cache)
+    except Exception:
+        # A bad row or an unreachable database must not keep the worker down
+        logger.exception("Starting cold, database warm up failed")
+        return
+    logger.info("Warmed %d connections and %d cached users", connections, users)
+
+
+@app.on_event("startup")
+async def start_archiver() -> None:
+    if archive_interval > 0:
+        app.state.archiver = create_task(archive_periodically(archive_interval))
+
+
+@app.on_event("shutdown")
+async def stop_archiver() -> None:
+    archiver: Optional[Task] = getattr(app.state, "archiver", None)
+    if archiver is not None:
+        archiver.cancel()
+        await gather(archiver, return_exceptions=True)
+
+
+@app.on_event("shutdown")
+def close_database() -> None:
+    # Runs after the server has stopped accepting and drained in-flight requests
+    shutdown()
+
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def metrics_endpoint() -> str:
+    return render()
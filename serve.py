@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""Production launcher: a pool of uvicorn worker processes serving `main:app`.
+
+The supervisor binds the socket once and starts the workers with the spawn
+method, so each is a fresh interpreter that imports the app itself and
+inherits nothing but the listening socket, which they share. Each worker
+runs the app's startup handlers, opening and warming its own database
+connections, before it accepts a connection. On SIGTERM or SIGINT the
+supervisor terminates the workers, which stop accepting, let in-flight
+requests finish, then run the shutdown handlers that close the connections.
+A second signal delivered to a worker skips the wait. The supervisor does
+not replace workers that die.
+
+    python serve.py [--workers N] [--host HOST] [--port PORT]
+"""
+import os
+from argparse import ArgumentParser
+
+import uvicorn
+
+
+def default_workers() -> int:
+    """WEB_CONCURRENCY, or one worker per core this process may run on."""
+    if "WEB_CONCURRENCY" in os.environ:
+        return int(os.environ["WEB_CONCURRENCY"])
+    return len(os.sched_getaffinity(0))
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default=os.environ.get("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", 8000)))
+    parser.add_argument("--workers", type=int, default=default_workers())
+    parser.add_argument("--keep-alive", type=int, default=5)
+    args = parser.parse_args()
+
+    uvicorn.run(
+        "main:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        lifespan="on",
+        proxy_headers=True,
+        timeout_keep_alive=args.keep_alive,
+    )
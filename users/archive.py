@@ -0,0 +1,293 @@
+"""Archival of soft deleted users, and their restoration.
+
+Users soft deleted more than `archive_after` seconds ago are moved from the
+users table to users_archive, a batch per transaction with a pause between
+batches, so the hot table and its indexes only hold live users and the few
+recently deleted ones. Restoring a user undoes a soft delete, moving the user
+back from the archive if it has been archived.
+
+The job runs from utils/archive_users.py, or every USERS_ARCHIVE_INTERVAL
+seconds in each worker. Batches select their rows with SKIP LOCKED, so
+concurrent runs split the work rather than queue behind each other.
+"""
+from asyncio import sleep as async_sleep
+from datetime import datetime, timezone
+from functools import partial
+from logging import Logger, getLogger
+from os import environ
+from time import sleep
+from typing import Callable, List, Optional
+
+from psycopg2.errors import UniqueViolation
+
+from database.database import (
+    Query,
+    QueryResult,
+    TableName,
+    Template,
+    compile_query,
+    connect,
+    default_config,
+    returning,
+    run_async,
+    update_table,
+    where_constraint,
+)
+from utils.metrics import Counter
+
+from .models import User
+from .service import (
+    DuplicateEmail,
+    UserNotFound,
+    invalidate_user,
+    table_name,
+    user_fields,
+    users_template,
+)
+
+logger: Logger = getLogger(__name__)
+
+# Seconds a soft deleted user stays in the users table, 30 days by default
+archive_after: float = float(environ.get("USERS_ARCHIVE_AFTER", 30 * 24 * 3600))
+archive_batch_size: int = int(environ.get("USERS_ARCHIVE_BATCH_SIZE", 500))
+# Seconds between batches, leaving room for the traffic the job competes with
+archive_pause: float = float(environ.get("USERS_ARCHIVE_PAUSE", 0.1))
+# Seconds between in-process runs. 0 leaves archival to the CLI.
+archive_interval: float = float(environ.get("USERS_ARCHIVE_INTERVAL", 0))
+
+archived_users = Counter(
+    "users_archived_total", "Soft deleted users moved to the archive table"
+)
+
+# Columns a user keeps in the archive, besides the time it was archived
+archived_fields: List[str] = user_fields
+
+
+def archive_table_name() -> TableName:
+    return (
+        "test_users_archive"
+        if environ.get("TEST", "False") == "True"
+        else "users_archive"
+    )
+
+
+def archive_users_query(table: TableName, archive: TableName) -> Query:
+    """Move a batch of users soft deleted before a cutoff to the archive.
+
+    Binds the retention in seconds and then the batch size, and returns the
+    archived ids.
+    """
+    columns: str = ", ".join(archived_fields)
+    return (
+        "WITH archived AS ("
+        f"DELETE FROM {table} WHERE id IN ("
+        f"SELECT id FROM {table}"
+        " WHERE deleted_at < (CURRENT_TIMESTAMP AT TIME ZONE 'UTC')"
+        " - %s * INTERVAL '1 second'"
+        " ORDER BY deleted_at LIMIT %s FOR UPDATE SKIP LOCKED)"
+        f" RETURNING {columns})"
+        f" INSERT INTO {archive} ({columns}) SELECT {columns} FROM archived"
+        " RETURNING id"
+    )
+
+
+def undelete_user_query(table: TableName) -> Query:
+    """UPDATE clearing the soft delete of a user, binding updated_at and the id."""
+    update_table_users: Callable = update_table(table)
+    where_id_is_deleted: Callable = where_constraint(
+        ["id = %s", "deleted_at IS NOT NULL"]
+    )
+    returning_user: Callable = returning(user_fields)
+    return returning_user(
+        where_id_is_deleted(update_table_users("deleted_at = NULL, updated_at = %s"))
+    )
+
+
+def unarchive_user_query(table: TableName, archive: TableName) -> Query:
+    """Move a user back from the archive, binding the id and then updated_at."""
+    columns: str = ", ".join(["fullname", "phone_number", "email", "id", "created_at"])
+    return (
+        f"WITH restored AS (DELETE FROM {archive} WHERE id = %s RETURNING {columns})"
+        f" INSERT INTO {table} ({columns}, updated_at)"
+        f" SELECT {columns}, %s FROM restored"
+        f" RETURNING {', '.join(user_fields)}"
+    )
+
+
+def archive_template(name: str, build: Callable[..., Query]) -> Template:
+    """Compiled `build(table, archive)` for the current users tables."""
+    table: TableName = table_name()
+    archive: TableName = archive_table_name()
+    return compile_query(name, partial(build, table, archive), table, archive)
+
+
+def archive_batch(
+    retention: float = archive_after, batch_size: int = archive_batch_size
+) -> int:
+    """Archive one batch in its own transaction, returning how many users moved."""
+    archive_users: Template = archive_template("archive_users", archive_users_query)
+    archived: int = len(archive_users((retention, batch_size)))
+    archived_users.inc(amount=archived)
+    return archived
+
+
+def archive_deleted_users(
+    retention: float = archive_after,
+    batch_size: int = archive_batch_size,
+    pause: float = archive_pause,
+    max_batches: Optional[int] = None,
+) -> int:
+    """Archive batches until one comes back short, returning the users moved."""
+    archived: int = 0
+    batches: int = 0
+    while max_batches is None or batches < max_batches:
+        count: int = archive_batch(retention, batch_size)
+        archived += count
+        batches += 1
+        if count < batch_size:
+            break
+        sleep(pause)
+    return archived
+
+
+async def archive_deleted_users_async(
+    retention: float = archive_after,
+    batch_size: int = archive_batch_size,
+    pause: float = archive_pause,
+) -> int:
+    """archive_deleted_users() that frees the executor between batches."""
+    archived: int = 0
+    while True:
+        count: int = await run_async(archive_batch, retention, batch_size)
+        archived += count
+        if count < batch_size:
+            return archived
+        await async_sleep(pause)
+
+
+async def archive_periodically(interval: float = archive_interval) -> None:
+    """Archive every `interval` seconds until cancelled."""
+    while True:
+        await async_sleep(interval)
+        try:
+            archived: int = await archive_deleted_users_async()
+        except Exception:
+            # Whatever failed, e.g. an exhausted pool, the next run may succeed
+            logger.exception("Archiving deleted users failed")
+            continue
+        if archived:
+            logger.info("Archived %d deleted users", archived)
+
+
+def vacuum_users() -> None:
+    """VACUUM ANALYZE the users table, making the archived rows' space reusable.
+
+    VACUUM can not run in a transaction, so this uses its own connection.
+    """
+    connection = connect(default_config)
+    connection.autocommit = True
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f"VACUUM (ANALYZE) {table_name()}")
+    finally:
+        connection.close()
+
+
+def restore_user(user_id: int) -> User:
+    """Undo the soft delete of a user, wherever it is now.
+
+    Raises DuplicateEmail when a live user has taken the email meanwhile.
+    """
+    updated_at: str = str(datetime.now(timezone.utc))
+    undelete_user: Template = users_template("undelete_user", undelete_user_query)
+    unarchive_user: Template = archive_template("unarchive_user", unarchive_user_query)
+    try:
+        result: QueryResult = undelete_user((updated_at, user_id))
+        if not result:
+            result = unarchive_user((user_id, updated_at))
+    except UniqueViolation as err:
+        raise DuplicateEmail(f"Email of user {user_id} is taken") from err
+    if not result:
+        raise UserNotFound(f"No deleted user with id {user_id}")
+
+    user: User = User(*result[0])
+    invalidate_user(user.id, user.email)
+    return user
+
+
+async def restore_user_async(user_id: int) -> User:
+    return await run_async(restore_user, user_id)
+
+
+if __name__ == "__main__":
+    import os
+
+    from utils.test_server import transactional
+
+    from .service import delete_user, get_user_by_id, get_users, insert_user, patch_user
+
+    os.environ["TEST"] = "True"
+
+    @transactional("users")
+    def _test_archive_deleted_users():
+        users: List[User] = get_users()
+        ids: List[int] = [user.id for user in users[:3] if user.id is not None]
+        for user_id in ids:
+            patch_user(user_id, {"deleted_at": "2000-01-01"})
+        # Deleted just now, so within any retention period
+        delete_user(users[3].id)
+
+        assert archive_deleted_users(retention=3600, batch_size=2, pause=0) == 3
+        assert archive_deleted_users(retention=3600, batch_size=2, pause=0) == 0
+        assert archived_users.totals()[()] == 3
+
+        # Restored from the archive, and from the hot table
+        for user_id in [ids[0], users[3].id]:
+            restored: User = restore_user(user_id)
+            assert restored.deleted_at is None
+            assert get_user_by_id(user_id).email == restored.email
+
+        try:
+            restore_user(ids[0])
+        except UserNotFound:
+            pass
+        else:
+            raise Exception("A live user was restored")
+
+        insert_user(
+            User(fullname="taken", email=users[1].email, phone_number="3333333333")
+        )
+        try:
+            restore_user(ids[1])
+        except DuplicateEmail:
+            pass
+        else:
+            raise Exception("A restored user took a live user's email")
+
+    def _test_archive_periodically_survives_errors():
+        import asyncio
+
+        runs: List[int] = []
+        archive = globals()["archive_deleted_users_async"]
+
+        async def failing() -> int:
+            runs.append(1)
+            raise RuntimeError("pool exhausted")
+
+        async def run_for_a_while() -> None:
+            task = asyncio.create_task(archive_periodically(0.001))
+            await asyncio.sleep(0.05)
+            assert not task.done()
+            task.cancel()
+
+        globals()["archive_deleted_users_async"] = failing
+        logger.disabled = True
+        try:
+            asyncio.run(run_for_a_while())
+        finally:
+            globals()["archive_deleted_users_async"] = archive
+            logger.disabled = False
+        assert len(runs) > 1
+
+    _test_archive_deleted_users()
+    _test_archive_periodically_survives_errors()
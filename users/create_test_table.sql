@@ -5,7 +5,41 @@ CREATE TABLE IF NOT EXISTS test_users (
 	email VARCHAR ( 255 ) UNIQUE,
 	created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
-    deleted_at TIMESTAMP
+    deleted_at TIMESTAMP,
+    CONSTRAINT test_users_contact_check CHECK (email IS NOT NULL OR phone_number IS NOT NULL)
 );
 
 
+
+CREATE TABLE IF NOT EXISTS test_users_version (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    version BIGINT NOT NULL DEFAULT 0,
+    changed_at TIMESTAMP NOT NULL DEFAULT (CURRENT_TIMESTAMP AT TIME ZONE 'UTC')
+);
+
+INSERT INTO test_users_version DEFAULT VALUES ON CONFLICT DO NOTHING;
+
+CREATE OR REPLACE FUNCTION bump_test_users_version() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    UPDATE test_users_version SET
+        version = version + 1,
+        changed_at = GREATEST(changed_at, clock_timestamp() AT TIME ZONE 'UTC');
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER test_users_version_bump
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON test_users
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_test_users_version();
+
+CREATE TABLE IF NOT EXISTS test_users_archive (
+	id INTEGER PRIMARY KEY,
+	fullname VARCHAR ( 255 ) NOT NULL,
+	phone_number VARCHAR ( 50 ),
+	email VARCHAR ( 255 ),
+	created_at TIMESTAMP NOT NULL,
+    updated_at TIMESTAMP NOT NULL,
+    deleted_at TIMESTAMP NOT NULL,
+    archived_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
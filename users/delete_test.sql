@@ -1 +0,0 @@
-DELETE FROM test_users WHERE fullname ~ 'test_'
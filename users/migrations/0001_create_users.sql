@@ -1,4 +1,4 @@
-CREATE TABLE users (
+CREATE TABLE IF NOT EXISTS users (
 	id serial PRIMARY KEY,
 	fullname VARCHAR ( 255 ) NOT NULL,
 	phone_number VARCHAR ( 50 ),
@@ -7,4 +7,3 @@ CREATE TABLE users (
     updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
     deleted_at TIMESTAMP
 );
-
@@ -0,0 +1,11 @@
+-- migrate: no-transaction
+
+-- GET /users pages through live users by (created_at DESC, id DESC)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS users_live_created_at_id_idx
+    ON users (created_at DESC, id DESC)
+    WHERE deleted_at IS NULL;
+
+-- Same name as the index behind the UNIQUE constraint, so this is a no-op
+-- wherever 0001 created the table and only builds it where it was missing
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS users_email_key
+    ON users (email);
@@ -0,0 +1,7 @@
+-- migrate: no-transaction
+
+-- The GET /users ETag probe, MAX(updated_at) and COUNT(*) of live users, is
+-- answered from this index without reading the table
+CREATE INDEX CONCURRENTLY IF NOT EXISTS users_live_updated_at_idx
+    ON users (updated_at)
+    WHERE deleted_at IS NULL;
@@ -0,0 +1,16 @@
+-- migrate: no-transaction
+
+-- GET /users/search prefix matches. In byte order ("C") LIKE 'term%' walks
+-- the index whatever the database collation is, and id after the matched
+-- value hands out each page of matches in the order search reads them.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS users_live_fullname_prefix_idx
+    ON users ((lower(fullname)) COLLATE "C", id)
+    WHERE deleted_at IS NULL;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS users_live_email_prefix_idx
+    ON users ((lower(email)) COLLATE "C", id)
+    WHERE deleted_at IS NULL;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS users_live_phone_number_prefix_idx
+    ON users (phone_number COLLATE "C", id)
+    WHERE deleted_at IS NULL;
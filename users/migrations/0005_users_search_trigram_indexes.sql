@@ -0,0 +1,18 @@
+-- migrate: no-transaction
+-- migrate: requires-extension pg_trgm
+
+-- GET /users/search fuzzy matches, `term <% lower(fullname)` closest first,
+-- which needs the pg_trgm extension from postgresql-contrib. Where contrib is
+-- not installed this migration waits, and search falls back to prefix
+-- matches only.
+--
+-- GiST rather than GIN, since only GiST hands out matches closest first and
+-- so stops after a page. The wide signature keeps a term matching few names
+-- from visiting most of the index. Emails are left to prefix matches: their
+-- digits and domains fill the signatures, and a fuzzy scan of them took
+-- 60-130 ms for a term matching nothing on a million users.
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS users_live_fullname_trgm_idx
+    ON users USING gist (lower(fullname) gist_trgm_ops (siglen = 256))
+    WHERE deleted_at IS NULL;
@@ -0,0 +1,20 @@
+-- migrate: no-transaction
+
+-- Soft deleted users moved out of the users table by users/archive.py. Emails
+-- are not unique here: a live user may have taken an archived user's email.
+CREATE TABLE IF NOT EXISTS users_archive (
+    id INTEGER PRIMARY KEY,
+    fullname VARCHAR ( 255 ) NOT NULL,
+    phone_number VARCHAR ( 50 ),
+    email VARCHAR ( 255 ),
+    created_at TIMESTAMP NOT NULL,
+    updated_at TIMESTAMP NOT NULL,
+    deleted_at TIMESTAMP NOT NULL,
+    archived_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- The archival job picks the oldest soft deleted users through this index,
+-- which only ever holds the rows still waiting to be archived
+CREATE INDEX CONCURRENTLY IF NOT EXISTS users_deleted_at_idx
+    ON users (deleted_at)
+    WHERE deleted_at IS NOT NULL;
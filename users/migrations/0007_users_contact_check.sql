@@ -0,0 +1,33 @@
+-- migrate: no-transaction
+
+-- Every user keeps an email or a phone number. Rows written before PATCH
+-- enforced that may have neither, and VALIDATE would fail on them, so they
+-- are reported first: give them a contact or delete them, then run again.
+DO $$
+DECLARE
+    offending TEXT;
+BEGIN
+    SELECT string_agg(id::text, ', ' ORDER BY id) INTO offending
+    FROM (
+        SELECT id FROM users
+        WHERE email IS NULL AND phone_number IS NULL
+        ORDER BY id LIMIT 100
+    ) AS missing;
+    IF offending IS NOT NULL THEN
+        RAISE EXCEPTION 'users without an email or phone number: %', offending
+            USING HINT = 'Give them a contact or delete them, then migrate again';
+    END IF;
+END
+$$;
+
+-- NOT VALID adds the constraint without scanning the table, and VALIDATE
+-- then checks the existing rows under a lock that lets reads and writes
+-- through. Dropping it first lets a run that failed in between start over.
+ALTER TABLE users DROP CONSTRAINT IF EXISTS users_contact_check;
+
+ALTER TABLE users
+    ADD CONSTRAINT users_contact_check
+    CHECK (email IS NOT NULL OR phone_number IS NOT NULL)
+    NOT VALID;
+
+ALTER TABLE users VALIDATE CONSTRAINT users_contact_check;
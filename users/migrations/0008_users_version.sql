@@ -0,0 +1,29 @@
+-- The GET /users ETag probe reads this single row instead of aggregating the
+-- live users, which cost a scan of the whole table on every request. A
+-- statement level trigger bumps it in the writing transaction, so the new
+-- version commits together with the rows it stands for.
+CREATE TABLE IF NOT EXISTS users_version (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    version BIGINT NOT NULL DEFAULT 0,
+    changed_at TIMESTAMP NOT NULL DEFAULT (CURRENT_TIMESTAMP AT TIME ZONE 'UTC')
+);
+
+INSERT INTO users_version DEFAULT VALUES ON CONFLICT DO NOTHING;
+
+-- clock_timestamp() rather than the transaction start, which may be older
+-- than the change committed before this one took the row lock
+CREATE OR REPLACE FUNCTION bump_users_version() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    UPDATE users_version SET
+        version = version + 1,
+        changed_at = GREATEST(changed_at, clock_timestamp() AT TIME ZONE 'UTC');
+    RETURN NULL;
+END
+$$;
+
+DROP TRIGGER IF EXISTS users_version_bump ON users;
+
+CREATE TRIGGER users_version_bump
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON users
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_users_version();
@@ -0,0 +1,6 @@
+-- migrate: no-transaction
+
+-- Only the GET /users ETag probe used this index, and 0008 replaced that
+-- probe. Every write changes updated_at, so the index also kept updates
+-- from being HOT.
+DROP INDEX CONCURRENTLY IF EXISTS users_live_updated_at_idx;
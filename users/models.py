@@ -1,16 +1,16 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
-from typing import Union
+from dataclasses import dataclass, fields
+from typing import Tuple, Union
 
-from pydantic import BaseModel
+from pydantic import BaseModel, conlist, root_validator, validator
 
 
 class MissingRequiredField(Exception):
     pass
 
 
-@dataclass
+@dataclass(slots=True)
 class User:
     fullname: str
     phone_number: str
@@ -41,7 +41,7 @@ class User:
         }
 
 
-@dataclass
+@dataclass(slots=True)
 class UserResponse:
     fullname: str
     id: Union[int, None] = None
@@ -56,3 +56,73 @@ class UserResponse:
             phone_number=user.phone_number,
             email=user.email,
         )
+
+
+# Most ids a single batch lookup accepts
+max_batch_ids: int = 1000
+BatchIds = conlist(int, min_items=1, max_items=max_batch_ids)
+
+# Columns a UserResponse is built from, in the order its JSON objects list them
+response_fields: Tuple[str, ...] = tuple(field.name for field in fields(UserResponse))
+
+
+class UserIn(BaseModel):
+    """Request body of POST and PUT /users.
+
+    pydantic can not parse bodies into slotted dataclasses, since their
+    defaults are not class attributes, so requests go through this model.
+    """
+
+    fullname: str
+    phone_number: str
+    email: str
+
+    def to_model(self) -> User:
+        return User(**self.dict())
+
+
+class UserPatch(BaseModel):
+    fullname: Union[str, None] = None
+    phone_number: Union[str, None] = None
+    email: Union[str, None] = None
+
+    @validator("fullname", pre=True)
+    def fullname_is_not_null(cls, value: Union[str, None]) -> str:
+        # Pre validators only run for fields present in the request
+        if value is None:
+            raise ValueError("fullname can not be null")
+        return value
+
+    @root_validator(pre=True)
+    def keeps_a_contact(cls, values: dict) -> dict:
+        # Nulling just one of them is checked against the stored row instead
+        contacts = ("email", "phone_number")
+        if all(key in values and values[key] is None for key in contacts):
+            raise ValueError("Phone Number or email is required")
+        return values
+
+    def changes(self) -> dict:
+        return self.dict(exclude_unset=True)
+
+
+class UserOut(BaseModel):
+    """Schema of the users listed by GET /users, /users/search and batch-get.
+
+    Those routes encode rows straight to JSON, so this only documents them.
+    FastAPI can not build the OpenAPI schema of a dataclass response model
+    used by more than one route, which UserResponse would be.
+    """
+
+    fullname: str
+    id: Union[int, None] = None
+    phone_number: Union[str, None] = None
+    email: Union[str, None] = None
+
+    class Config:
+        orm_mode = True
+
+
+class UserIds(BaseModel):
+    """Request body of POST /users/batch-get."""
+
+    ids: BatchIds
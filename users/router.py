@@ -1,56 +1,306 @@
-from typing import List
-
-from fastapi import APIRouter, HTTPException
-
-from .models import User, UserResponse
+from dataclasses import asdict, replace
+from datetime import datetime
+from json import JSONDecodeError, dumps, loads
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple, Union
+
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError, parse_obj_as
+
+from utils.conditional import entity_tag, not_modified, validators
+
+from .archive import restore_user_async
+from .models import (
+    MissingRequiredField,
+    User,
+    UserIds,
+    UserIn,
+    UserOut,
+    UserPatch,
+    UserResponse,
+    max_batch_ids,
+    response_fields,
+)
+from .serializers import UserRowResponse, UserRowsResponse
 from .service import (
+    DuplicateEmail,
+    InvalidCursor,
+    InvalidFields,
     UserNotFound,
-    delete_user,
-    get_user_by_id,
-    get_users,
-    insert_user,
-    update_user,
+    delete_user_async,
+    get_user_by_id_async,
+    get_user_row_by_id_async,
+    get_users_by_ids_async,
+    get_users_rows_page_async,
+    get_users_version_async,
+    insert_user_async,
+    insert_users_async,
+    page_columns,
+    parse_fields,
+    patch_user_async,
+    search_columns,
+    search_users_rows_async,
+    stream_users_async,
+    update_user_async,
 )
 
 router = APIRouter()
 
+fields_description: str = "Comma separated user fields to return, e.g. id,email"
+ids_description: str = (
+    "Comma separated user ids, e.g. 1,2,3. Returns the users found among them"
+    " in one query, in place of a page"
+)
+export_media_types = {"ndjson": "application/x-ndjson", "json": "application/json"}
+
+
+def _user_json(user: User) -> str:
+    return dumps(asdict(UserResponse.from_model(user)))
+
+
+async def _export_ndjson() -> AsyncIterator[str]:
+    async for users in stream_users_async():
+        yield "".join(f"{_user_json(user)}\n" for user in users)
+
 
-@router.get("/users", responses={404: {"description": "Users Not Found"}})
-async def get_users_endpoint() -> List[UserResponse]:
+def _requested_fields(fields: Optional[str]) -> Tuple[str, ...]:
+    if fields is None:
+        return response_fields
     try:
-        return [UserResponse.from_model(user) for user in get_users()]
+        return parse_fields(fields)
+    except InvalidFields as err:
+        raise HTTPException(status_code=400, detail=str(err)) from err
+
+
+def _parse_ids(ids: str) -> List[int]:
+    try:
+        parsed: List[int] = [int(id) for id in ids.split(",")]
+    except ValueError as err:
+        raise HTTPException(status_code=400, detail=f"Invalid ids {ids}") from err
+    if len(parsed) > max_batch_ids:
+        raise HTTPException(
+            status_code=400, detail=f"At most {max_batch_ids} ids per request"
+        )
+    return parsed
+
+
+async def _users_by_ids(ids: List[int], columns: Tuple[str, ...]) -> UserRowsResponse:
+    """The users that exist among `ids`, once each, in the order requested."""
+    try:
+        users: Dict[int, User] = await get_users_by_ids_async(ids)
     except Exception as err:
-        import pdb
+        raise HTTPException(status_code=500, detail="SERVER ERROR") from err
+
+    rows: List[Tuple] = [
+        tuple(getattr(users[id], column) for column in columns)
+        for id in dict.fromkeys(ids)
+        if id in users
+    ]
+    return UserRowsResponse(rows, columns, columns)
+
+
+def _parse_bulk_body(body: bytes, content_type: str) -> List[Any]:
+    if content_type.startswith("application/x-ndjson"):
+        return [loads(line) for line in body.splitlines() if line.strip()]
 
-        pdb.set_trace()
+    items = loads(body)
+    if not isinstance(items, list):
+        raise ValueError("Expected a JSON array of users")
+    return items
+
+
+async def _export_json() -> AsyncIterator[str]:
+    separator: str = ""
+    yield "["
+    async for users in stream_users_async():
+        yield separator + ",".join(_user_json(user) for user in users)
+        separator = ","
+    yield "]"
+
+
+@router.get(
+    "/users",
+    response_model=List[UserOut],
+    response_class=UserRowsResponse,
+    responses={
+        400: {"description": "Invalid Cursor, Fields or Ids"},
+        404: {"description": "Users Not Found"},
+    },
+)
+async def get_users_endpoint(
+    request: Request,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = Query(None, description=fields_description),
+    ids: Optional[str] = Query(None, description=ids_description),
+) -> UserRowsResponse:
+    columns: Tuple[str, ...] = _requested_fields(fields)
+    if ids is not None:
+        return await _users_by_ids(_parse_ids(ids), columns)
+    try:
+        # Probed before the page is read, so the tag is never newer than the body
+        changed_at, version = await get_users_version_async()
+        etag: str = entity_tag(version, limit, cursor, *columns)
+        headers: Dict[str, str] = validators(etag, changed_at)
+        if not_modified(request, etag, changed_at):
+            return Response(status_code=304, headers=headers)
+
+        rows, next_cursor = await get_users_rows_page_async(limit, cursor, columns)
+    except InvalidCursor as err:
+        raise HTTPException(status_code=400, detail="Invalid cursor") from err
+    except Exception as err:
         raise HTTPException(status_code=404, detail="Users not found") from err
 
+    if next_cursor is not None:
+        headers["X-Next-Cursor"] = next_cursor
+    return UserRowsResponse(rows, page_columns(columns), columns, headers=headers)
+
+
+@router.get("/users/export")
+async def export_users_endpoint(
+    format: str = Query("ndjson", regex="^(ndjson|json)$")
+) -> StreamingResponse:
+    export = _export_ndjson() if format == "ndjson" else _export_json()
+    return StreamingResponse(export, media_type=export_media_types[format])
+
+
+@router.get(
+    "/users/search",
+    response_model=List[UserOut],
+    response_class=UserRowsResponse,
+    responses={
+        400: {"description": "Invalid Cursor or Fields"},
+        500: {"description": "SERVER ERROR"},
+    },
+)
+async def search_users_endpoint(
+    q: str = Query(..., min_length=3, max_length=255),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = Query(None, description=fields_description),
+) -> UserRowsResponse:
+    """Live users whose name, email or phone number starts with `q`, or whose
+    name resembles it, best matches first."""
+    columns: Tuple[str, ...] = _requested_fields(fields)
+    try:
+        rows, next_cursor = await search_users_rows_async(q, limit, cursor, columns)
+    except InvalidCursor as err:
+        raise HTTPException(status_code=400, detail="Invalid cursor") from err
+    except Exception as err:
+        raise HTTPException(status_code=500, detail="SERVER ERROR") from err
+
+    headers: Dict[str, str] = {}
+    if next_cursor is not None:
+        headers["X-Next-Cursor"] = next_cursor
+    return UserRowsResponse(rows, search_columns(columns), columns, headers=headers)
+
 
 @router.get(
     "/users/{user_id}",
     responses={
+        400: {"description": "Invalid Fields"},
         404: {"description": "User Not Found"},
         500: {"description": "SERVER ERROR"},
     },
 )
-async def get_user_by_id_enpoint(user_id: int) -> UserResponse:
+async def get_user_by_id_enpoint(
+    request: Request,
+    user_id: int,
+    fields: Optional[str] = Query(None, description=fields_description),
+) -> Response:
+    columns: Tuple[str, ...] = _requested_fields(fields)
+    # updated_at versions the user, so it is read even when not requested
+    row_columns: Tuple[str, ...] = tuple(dict.fromkeys((*columns, "updated_at")))
     try:
-        return UserResponse.from_model(get_user_by_id(user_id))
+        if fields is None:
+            user: User = await get_user_by_id_async(user_id)
+            row: Tuple = tuple(getattr(user, column) for column in row_columns)
+        else:
+            row = await get_user_row_by_id_async(user_id, row_columns)
     except UserNotFound as err:
         raise HTTPException(status_code=404, detail="Users not found") from err
     except Exception as err:
         raise HTTPException(status_code=500, detail="SERVER ERROR") from err
 
+    updated_at: datetime = row[row_columns.index("updated_at")]
+    etag: str = entity_tag(user_id, updated_at, *columns)
+    headers: Dict[str, str] = validators(etag, updated_at)
+    if not_modified(request, etag, updated_at):
+        return Response(status_code=304, headers=headers)
+    return UserRowResponse(row, row_columns, columns, headers=headers)
+
 
 @router.post(
     "/users", status_code=201, responses={500: {"description": "SERVER ERROR"}}
 )
-async def new_user_endpoint(user: User) -> UserResponse:
+async def new_user_endpoint(user: UserIn) -> UserResponse:
+    try:
+        return UserResponse.from_model(await insert_user_async(user.to_model()))
+    except Exception as err:
+        raise HTTPException(status_code=500, detail="SERVER ERROR") from err
+
+
+@router.post(
+    "/users/bulk",
+    status_code=201,
+    responses={
+        400: {"description": "Invalid Body"},
+        500: {"description": "SERVER ERROR"},
+    },
+)
+async def bulk_new_users_endpoint(request: Request) -> Dict[str, List]:
+    """Create users from a JSON array or NDJSON body in one transaction.
+
+    Rows that fail validation or insertion are reported by their index in the
+    body; the rest are created.
+    """
     try:
-        return UserResponse.from_model(insert_user(user))
+        items = _parse_bulk_body(
+            await request.body(), request.headers.get("content-type", "")
+        )
+    except (JSONDecodeError, ValueError) as err:
+        raise HTTPException(status_code=400, detail=str(err)) from err
+
+    indexes: List[int] = []
+    users: List[User] = []
+    errors: List[Dict[str, Union[int, str]]] = []
+    for index, item in enumerate(items):
+        try:
+            users.append(parse_obj_as(UserIn, item).to_model())
+            indexes.append(index)
+        except (ValidationError, MissingRequiredField, TypeError) as err:
+            errors.append({"index": index, "detail": str(err)})
+
+    try:
+        results = await insert_users_async(users)
     except Exception as err:
         raise HTTPException(status_code=500, detail="SERVER ERROR") from err
 
+    created: List[Dict[str, Any]] = []
+    for index, result in zip(indexes, results):
+        if isinstance(result, Exception):
+            errors.append({"index": index, "detail": str(result).strip()})
+        else:
+            created.append({"index": index, **asdict(UserResponse.from_model(result))})
+
+    errors.sort(key=lambda error: error["index"])
+    return {"created": created, "errors": errors}
+
+
+@router.post(
+    "/users/batch-get",
+    response_model=List[UserOut],
+    response_class=UserRowsResponse,
+    responses={
+        400: {"description": "Invalid Fields"},
+        500: {"description": "SERVER ERROR"},
+    },
+)
+async def batch_get_users_endpoint(
+    body: UserIds, fields: Optional[str] = Query(None, description=fields_description)
+) -> UserRowsResponse:
+    return await _users_by_ids(body.ids, _requested_fields(fields))
+
 
 @router.put(
     "/users/{user_id}",
@@ -59,12 +309,31 @@ async def new_user_endpoint(user: User) -> UserResponse:
         500: {"description": "SERVER ERROR"},
     },
 )
-async def update_user_endpoint(user_id: int, user: User) -> UserResponse:
+async def update_user_endpoint(user_id: int, user: UserIn) -> UserResponse:
+    try:
+        updated: User = replace(user.to_model(), id=user_id)
+        return UserResponse.from_model(await update_user_async(updated))
+    except UserNotFound as err:
+        raise HTTPException(status_code=404, detail="Users not found") from err
+    except Exception as err:
+        raise HTTPException(status_code=500, detail="SERVER ERROR") from err
+
+
+@router.patch(
+    "/users/{user_id}",
+    responses={
+        404: {"description": "User Not Found"},
+        422: {"description": "Phone Number or email is required"},
+        500: {"description": "SERVER ERROR"},
+    },
+)
+async def patch_user_endpoint(user_id: int, patch: UserPatch) -> UserResponse:
     try:
-        user.id = user_id
-        return UserResponse.from_model(update_user(user))
+        return UserResponse.from_model(await patch_user_async(user_id, patch.changes()))
     except UserNotFound as err:
         raise HTTPException(status_code=404, detail="Users not found") from err
+    except MissingRequiredField as err:
+        raise HTTPException(status_code=422, detail=str(err)) from err
     except Exception as err:
         raise HTTPException(status_code=500, detail="SERVER ERROR") from err
 
@@ -79,87 +348,210 @@ async def update_user_endpoint(user_id: int, user: User) -> UserResponse:
 )
 async def delete_user_enpoint(user_id: int) -> None:
     try:
-        return delete_user(user_id)
+        return await delete_user_async(user_id)
     except UserNotFound as err:
         raise HTTPException(status_code=404, detail="Users not found") from err
     except Exception as err:
         raise HTTPException(status_code=500, detail="SERVER ERROR") from err
 
 
+@router.post(
+    "/users/{user_id}/restore",
+    responses={
+        404: {"description": "Deleted User Not Found"},
+        409: {"description": "Email Taken By Another User"},
+        500: {"description": "SERVER ERROR"},
+    },
+)
+async def restore_user_endpoint(user_id: int) -> UserResponse:
+    """Undo the deletion of a user, including one already archived."""
+    try:
+        return UserResponse.from_model(await restore_user_async(user_id))
+    except UserNotFound as err:
+        raise HTTPException(status_code=404, detail="User not found") from err
+    except DuplicateEmail as err:
+        raise HTTPException(status_code=409, detail=str(err)) from err
+    except Exception as err:
+        raise HTTPException(status_code=500, detail="SERVER ERROR") from err
+
+
 if __name__ == "__main__":
-    from multiprocessing import Process
     from os import environ
-    from time import sleep
 
-    import requests
-    import uvicorn
-    from fastapi import FastAPI
+    from utils.test_server import test_client, transactional
 
-    from utils.test_server import (
-        test_create_data,
-        test_delete_data,
-        test_router,
-        wait_for_server,
-    )
+    from .service import get_user_by_id, get_users
 
-    users_url = "http://127.0.0.1:8000/users"
-    proc = None
+    users_url = "/users"
+    client = test_client(router)
 
     environ["TEST"] = "True"
 
-    def _run_server(app):
-        uvicorn.run(app=app, host="127.0.0.1", port=8000)
+    @transactional("users")
+    def _test_get_users():
+        res = client.get(users_url)
+        users = res.json()
+        assert res.status_code == 200
+        assert len(users) > 0
+        return
 
-    def _start_server():
-        app = FastAPI()
-        app.include_router(router)
-        global proc
+    @transactional("users")
+    def _test_get_users_pagination():
+        res = client.get(users_url, params={"limit": 2})
+        first_page = res.json()
+        assert res.status_code == 200
+        assert len(first_page) == 2
 
-        proc = Process(target=_run_server, args=(app,), daemon=True)
-        proc.start()
+        cursor = res.headers["X-Next-Cursor"]
+        res = client.get(users_url, params={"limit": 2, "cursor": cursor})
+        second_page = res.json()
+        assert res.status_code == 200
+        assert {user["id"] for user in first_page}.isdisjoint(
+            {user["id"] for user in second_page}
+        )
 
-    def _stop_server():
-        global proc
+        res = client.get(users_url, params={"cursor": "not-a-cursor"})
+        assert res.status_code == 400
 
-        if proc:
-            proc.join(0.25)
+    @transactional("users")
+    def _test_export_users():
+        from json import loads
 
-    @test_router
-    @test_create_data("users")
-    @test_delete_data("users")
-    @wait_for_server
-    def _test_get_users():
-        res = requests.get(users_url)
-        users = res.json()
+        res = client.get(f"{users_url}/export", stream=True)
         assert res.status_code == 200
-        assert len(users) > 0
-        return
+        ndjson_users = [loads(line) for line in res.iter_lines() if line]
+        assert len(ndjson_users) >= 6
+
+        res = client.get(f"{users_url}/export", params={"format": "json"})
+        assert res.status_code == 200
+        assert res.json() == ndjson_users
 
-    @test_router
-    @test_create_data("users")
-    @test_delete_data("users")
-    @wait_for_server
+    @transactional("users")
     def _test_get_user_by_id():
         users = get_users()
         og_user = users[0]
-        res = requests.get(f"{users_url}/{og_user.id}")
+        res = client.get(f"{users_url}/{og_user.id}")
         user = res.json()
         assert res.status_code == 200
         assert user["id"] == og_user.id
         assert user["fullname"] == og_user.fullname
         assert user["email"] == og_user.email
 
-    @test_router
-    @test_create_data("users")
-    @test_delete_data("users")
-    @wait_for_server
+    @transactional("users")
+    def _test_sparse_fieldsets():
+        res = client.get(users_url, params={"limit": 2, "fields": "email,id"})
+        users = res.json()
+        assert res.status_code == 200
+        assert all(list(user) == ["email", "id"] for user in users)
+        res = client.get(
+            users_url,
+            params={
+                "limit": 2,
+                "fields": "email",
+                "cursor": res.headers["X-Next-Cursor"],
+            },
+        )
+        assert res.status_code == 200
+        assert {user["email"] for user in users}.isdisjoint(
+            {user["email"] for user in res.json()}
+        )
+
+        user_id = users[0]["id"]
+        res = client.get(f"{users_url}/{user_id}", params={"fields": "fullname"})
+        assert res.status_code == 200
+        assert list(res.json()) == ["fullname"]
+
+        res = client.get(users_url, params={"fields": "id,password"})
+        assert res.status_code == 400
+
+    @transactional("users")
+    def _test_batch_get_users():
+        ids = [user.id for user in get_users()[:3]]
+        res = client.get(users_url, params={"ids": f"{ids[2]},{ids[0]},-1"})
+        assert res.status_code == 200
+        assert [user["id"] for user in res.json()] == [ids[2], ids[0]]
+
+        res = client.post(
+            f"{users_url}/batch-get", params={"fields": "id"}, json={"ids": ids}
+        )
+        assert res.status_code == 200
+        assert res.json() == [{"id": id} for id in ids]
+
+        res = client.get(users_url, params={"ids": "1,a"})
+        assert res.status_code == 400
+        res = client.post(f"{users_url}/batch-get", json={"ids": []})
+        assert res.status_code == 422
+
+    @transactional("users")
+    def _test_search_users():
+        search_url = f"{users_url}/search"
+        res = client.get(search_url, params={"q": "TEST_wen", "limit": 4})
+        assert res.status_code == 200
+        assert len(res.json()) == 4
+        res = client.get(
+            search_url,
+            params={"q": "test_wen", "cursor": res.headers["X-Next-Cursor"]},
+        )
+        assert len(res.json()) == 2
+        assert "X-Next-Cursor" not in res.headers
+
+        res = client.get(search_url, params={"q": "testmail3", "fields": "email"})
+        assert res.json() == [{"email": "testmail3@gmail.com"}]
+        res = client.get(search_url, params={"q": "3794", "fields": "id"})
+        assert len(res.json()) == 6
+        # LIKE wildcards in the term are matched literally
+        assert client.get(search_url, params={"q": "%__"}).json() == []
+
+        assert client.get(search_url, params={"q": "te"}).status_code == 422
+        res = client.get(search_url, params={"q": "test", "cursor": "nope"})
+        assert res.status_code == 400
+
+    @transactional("users")
+    def _test_conditional_get():
+        res = client.get(users_url, params={"limit": 2})
+        list_etag = res.headers["ETag"]
+        res = client.get(
+            users_url, params={"limit": 2}, headers={"If-None-Match": list_etag}
+        )
+        assert res.status_code == 304
+        assert res.content == b""
+        res = client.get(
+            users_url, params={"limit": 3}, headers={"If-None-Match": list_etag}
+        )
+        assert res.status_code == 200
+
+        user_id = res.json()[0]["id"]
+        res = client.get(f"{users_url}/{user_id}")
+        etag, last_modified = res.headers["ETag"], res.headers["Last-Modified"]
+        res = client.get(
+            f"{users_url}/{user_id}", headers={"If-Modified-Since": last_modified}
+        )
+        assert res.status_code == 304
+        res = client.get(
+            f"{users_url}/{user_id}",
+            params={"fields": "id"},
+            headers={"If-None-Match": etag},
+        )
+        assert res.status_code == 200
+
+        client.patch(f"{users_url}/{user_id}", json={"fullname": "test_etag"})
+        res = client.get(f"{users_url}/{user_id}", headers={"If-None-Match": etag})
+        assert res.status_code == 200
+        assert res.json()["fullname"] == "test_etag"
+        res = client.get(
+            users_url, params={"limit": 2}, headers={"If-None-Match": list_etag}
+        )
+        assert res.status_code == 200
+        assert res.headers["ETag"] != list_etag
+
+    @transactional("users")
     def _test_insert_user():
         user = {
             "fullname": "test_inserted_user",
             "email": "test_inserted_email@email.com",
             "phone_number": "3789789789",
         }
-        res = requests.post(f"{users_url}", json=user)
+        res = client.post(f"{users_url}", json=user)
         user = res.json()
         assert res.status_code == 201
         assert user["id"] is not None
@@ -167,10 +559,34 @@ if __name__ == "__main__":
         assert db_user.fullname == user["fullname"]
         assert db_user.email == user["email"]
 
-    @test_router
-    @test_create_data("users")
-    @test_delete_data("users")
-    @wait_for_server
+    @transactional("users")
+    def _test_bulk_insert_users():
+        users = [
+            {
+                "fullname": f"test_bulk_user_{idx}",
+                "email": f"test_bulk_email_{idx}@email.com",
+                "phone_number": "3789789789",
+            }
+            for idx in range(3)
+        ]
+        users.append({"email": "test_missing_fullname@email.com"})
+        res = client.post(f"{users_url}/bulk", json=users)
+        report = res.json()
+        assert res.status_code == 201
+        assert [user["index"] for user in report["created"]] == [0, 1, 2]
+        assert [error["index"] for error in report["errors"]] == [3]
+
+        ndjson = "\n".join(dumps(user) for user in users[:1])
+        res = client.post(
+            f"{users_url}/bulk",
+            data=ndjson,
+            headers={"Content-Type": "application/x-ndjson"},
+        )
+        report = res.json()
+        assert res.status_code == 201
+        assert [error["index"] for error in report["errors"]] == [0]  # duplicate
+
+    @transactional("users")
     def _test_update_user():
         db_user = get_users()[0]
 
@@ -179,29 +595,70 @@ if __name__ == "__main__":
             "email": "test_user_email@email.com",
             "phone_number": "123078977",
         }
-        res = requests.put(f"{users_url}/{db_user.id}", json=update_user)
+        res = client.put(f"{users_url}/{db_user.id}", json=update_user)
         user = res.json()
         assert res.status_code == 200
         assert user["id"] is not None
         assert db_user.fullname != user["fullname"]
         assert db_user.email != user["email"]
 
-    @test_router
-    @test_create_data("users")
-    @test_delete_data("users")
-    @wait_for_server
+    @transactional("users")
+    def _test_patch_user():
+        db_user = get_users()[0]
+        res = client.patch(
+            f"{users_url}/{db_user.id}", json={"fullname": "test_patch_user"}
+        )
+        user = res.json()
+        assert res.status_code == 200
+        assert user["fullname"] == "test_patch_user"
+        assert user["email"] == db_user.email
+
+        res = client.patch(f"{users_url}/{db_user.id}", json={"fullname": None})
+        assert res.status_code == 422
+
+        res = client.patch(
+            f"{users_url}/{db_user.id}", json={"email": None, "phone_number": None}
+        )
+        assert res.status_code == 422
+
+        res = client.patch(f"{users_url}/{db_user.id}", json={"phone_number": None})
+        assert res.status_code == 200
+        res = client.patch(f"{users_url}/{db_user.id}", json={"email": None})
+        assert res.status_code == 422
+        assert client.get(f"{users_url}/{db_user.id}").json()["email"] == db_user.email
+
+    @transactional("users")
     def _test_delete_user():
         db_users = get_users()
         user = db_users[0]
-        res = requests.delete(f"{users_url}/{user.id}")
+        res = client.delete(f"{users_url}/{user.id}")
         assert res.status_code == 204
         new_db_users = get_users()
         assert len(db_users) > len(new_db_users)
 
-    _start_server()
+        res = client.post(f"{users_url}/{user.id}/restore")
+        assert res.status_code == 200
+        assert res.json()["email"] == user.email
+        assert len(get_users()) == len(db_users)
+        res = client.post(f"{users_url}/{user.id}/restore")
+        assert res.status_code == 404
+
+    def _test_openapi():
+        res = client.get("/openapi.json")
+        assert res.status_code == 200
+        assert "/users/search" in res.json()["paths"]
+
+    _test_openapi()
     _test_get_users()
+    _test_get_users_pagination()
+    _test_export_users()
     _test_get_user_by_id()
+    _test_sparse_fieldsets()
+    _test_batch_get_users()
+    _test_search_users()
+    _test_conditional_get()
     _test_insert_user()
+    _test_bulk_insert_users()
     _test_update_user()
+    _test_patch_user()
     _test_delete_user()
-    _stop_server()
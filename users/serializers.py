@@ -0,0 +1,113 @@
+from datetime import date, datetime
+from functools import lru_cache
+from json import dumps
+from json.encoder import encode_basestring
+from typing import Any, Callable, Iterable, Optional, Sequence, Tuple
+
+from starlette.background import BackgroundTask
+from starlette.responses import Response
+
+from .models import response_fields
+
+RowEncoder = Callable[[Tuple], str]
+
+
+def encode_value(value: Any) -> str:
+    if isinstance(value, str):
+        return encode_basestring(value)
+    if value is None:
+        return "null"
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, int):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return f'"{value.isoformat()}"'
+    return dumps(value)
+
+
+@lru_cache(maxsize=None)
+def row_encoder(row_columns: Tuple[str, ...], fields: Tuple[str, ...]) -> RowEncoder:
+    """Build a function encoding a DB row with `row_columns` as a JSON object.
+
+    The object has `fields` as keys, in that order. Keys are encoded once here
+    so encoding a row only has to encode its values.
+    """
+    indexes: Tuple[int, ...] = tuple(row_columns.index(field) for field in fields)
+    prefixes: Tuple[str, ...] = tuple(
+        ("{" if position == 0 else ",") + encode_basestring(field) + ":"
+        for position, field in enumerate(fields)
+    )
+    parts = tuple(zip(prefixes, indexes))
+
+    def encode(row: Tuple) -> str:
+        return (
+            "".join(prefix + encode_value(row[index]) for prefix, index in parts) + "}"
+        )
+
+    return encode
+
+
+def encode_rows(
+    rows: Iterable[Tuple],
+    row_columns: Sequence[str],
+    fields: Sequence[str] = response_fields,
+) -> bytes:
+    encode: RowEncoder = row_encoder(tuple(row_columns), tuple(fields))
+    return ("[" + ",".join(encode(row) for row in rows) + "]").encode()
+
+
+def encode_row(
+    row: Tuple,
+    row_columns: Sequence[str],
+    fields: Sequence[str] = response_fields,
+) -> bytes:
+    return row_encoder(tuple(row_columns), tuple(fields))(row).encode()
+
+
+class UserRowResponse(Response):
+    """JSON object of a single user encoded straight from its DB row."""
+
+    media_type = "application/json"
+
+    def __init__(
+        self,
+        row: Tuple,
+        row_columns: Sequence[str],
+        fields: Sequence[str] = response_fields,
+        status_code: int = 200,
+        headers: Optional[dict] = None,
+        background: Optional[BackgroundTask] = None,
+    ) -> None:
+        super().__init__(
+            encode_row(row, row_columns, fields),
+            status_code=status_code,
+            headers=headers,
+            background=background,
+        )
+
+
+class UserRowsResponse(Response):
+    """JSON list of users encoded straight from DB rows.
+
+    Skips building User and UserResponse objects and FastAPI's
+    jsonable_encoder, which dominate the cost of large lists.
+    """
+
+    media_type = "application/json"
+
+    def __init__(
+        self,
+        rows: Iterable[Tuple],
+        row_columns: Sequence[str],
+        fields: Sequence[str] = response_fields,
+        status_code: int = 200,
+        headers: Optional[dict] = None,
+        background: Optional[BackgroundTask] = None,
+    ) -> None:
+        super().__init__(
+            encode_rows(rows, row_columns, fields),
+            status_code=status_code,
+            headers=headers,
+            background=background,
+        )
@@ -1,29 +1,69 @@
-from dataclasses import fields
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as DecodeError
+from dataclasses import fields, replace
 from datetime import datetime, timezone
+from functools import lru_cache, partial
+from itertools import islice
 from os import environ
-from typing import Callable, List, Tuple
+from threading import Lock
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Hashable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+    Union,
+)
+
+from psycopg2.errors import CheckViolation
 
 from database.database import (
     AddConstraintToQuery,
+    Field,
     FromTable,
+    Parameters,
     Query,
     QueryResult,
+    TableName,
+    Template,
+    compile_query,
+    default_itersize,
     from_table,
     insert_into,
+    insert_many,
     insert_values,
+    keyset_constraint,
+    limit_constraint,
     order_by_constraint,
-    query,
+    reads_from_replicas,
+    returning,
+    run_async,
     select,
+    stream,
     update_table,
     update_values,
     where_constraint,
 )
+from database.replicas import mark_written, primary_reads, reads_from_primary
+from utils.batch import Batcher
+from utils.cache import MISSING, K, Missing, TTLCache, V
+from utils.metrics import Gauge
+from utils.singleflight import SingleFlight
+
+from .models import MissingRequiredField, User, response_fields
 
-from .models import User
+T = TypeVar("T")
 
 
 def table_name():
-    return "test_users" if bool(environ.get("TEST", "False")) else "users"
+    return "test_users" if environ.get("TEST", "False") == "True" else "users"
 
 
 class DuplicateID(Exception):
@@ -38,31 +78,599 @@ class UserNotFound(Exception):
     pass
 
 
-def __get_users_fields() -> List[str]:
-    user_fields_tuple: Tuple = fields(User)
-    return [field.name for field in user_fields_tuple]
+class InvalidCursor(Exception):
+    pass
+
+
+class InvalidFields(Exception):
+    pass
+
+
+# Opaque position in the (created_at, id) ordering of GET /users
+PageCursor = str
+PageKey = Tuple[str, int]
+# Opaque position in the (rank, matched, id) ordering of GET /users/search
+SearchCursor = str
+SearchKey = Tuple[float, str, int]
+# When the users table last changed and how many statements have changed it
+UsersVersion = Tuple[Optional[datetime], int]
+
+
+class NotFound:
+    """Cached in place of a user that does not exist."""
+
+
+NOT_FOUND = NotFound()
+
+# The cache is per process and a write only invalidates it in the worker that
+# made it. Every other worker may serve the old row, and answer 304 to its old
+# validators, until the entry expires, so the ttl is the staleness accepted in
+# exchange for absorbing bursts of reads of the same users.
+cache_ttl: float = float(environ.get("USERS_CACHE_TTL", 2))
+cache_negative_ttl: float = float(environ.get("USERS_CACHE_NEGATIVE_TTL", 1))
+cache_size: int = int(environ.get("USERS_CACHE_SIZE", 10_000))
+# Longest a lookup read from a replica is cached, since the replica may lag
+# behind a write that invalidated it
+cache_replica_ttl: float = float(environ.get("USERS_CACHE_REPLICA_TTL", 1))
+# Newest users loaded into the cache when a worker starts
+cache_warm: int = int(environ.get("USERS_CACHE_WARM", 0))
+
+# Lookups by email resolve to an id, and the user itself is only cached by id,
+# so a stale email mapping is caught when the user it points to disagrees.
+users_by_id: TTLCache[Tuple[str, int], Union[User, NotFound]] = TTLCache(
+    cache_size, cache_ttl
+)
+user_ids_by_email: TTLCache[Tuple[str, str], Union[int, NotFound]] = TTLCache(
+    cache_size, cache_ttl
+)
+
+
+# GET /users/{id} lookups that miss the cache within this window share a query
+loader_window: float = float(environ.get("USERS_LOADER_WINDOW", 0.002))
+loader_max_batch: int = int(environ.get("USERS_LOADER_MAX_BATCH", 100))
+
+# With False, search only matches prefixes even where pg_trgm is installed
+search_fuzzy: bool = environ.get("USERS_SEARCH_FUZZY", "True") == "True"
+# Fuzzy search only looks this far among the names closest to the term, so
+# its cost stays flat however many names resemble it
+search_closest_names: int = int(environ.get("USERS_SEARCH_CLOSEST_NAMES", 100))
+
+# POST /users inserts arriving within this window share one INSERT and commit.
+# 0 inserts each user on its own.
+inserter_window: float = float(environ.get("USERS_INSERTER_WINDOW", 0))
+inserter_max_batch: int = int(environ.get("USERS_INSERTER_MAX_BATCH", 100))
+
+
+def invalidate_user(user_id: Optional[int], email: Optional[str] = None) -> None:
+    table: str = table_name()
+    if user_id is not None:
+        users_by_id.delete((table, user_id))
+    if email is not None:
+        user_ids_by_email.delete((table, email))
+
+
+def _cached(cache: TTLCache[K, V], key: K) -> Union[V, Missing]:
+    """`cache[key]`, or MISSING for a session that has to see its own writes."""
+    return MISSING if reads_from_primary() else cache.get(key)
+
+
+def _cache(
+    cache: TTLCache[K, V], key: K, value: V, ttl: Optional[float] = None
+) -> None:
+    """Cache `value`, for at most cache_replica_ttl if it may be from a replica."""
+    if reads_from_replicas():
+        ttl = min(cache.ttl if ttl is None else ttl, cache_replica_ttl)
+    cache.set(key, value, ttl)
+
+
+def cache_stats() -> Dict[str, Dict[str, Any]]:
+    return {"by_id": users_by_id.stats(), "by_email": user_ids_by_email.stats()}
+
+
+def _cache_samples(stat: str) -> Callable[[], Dict[Tuple[str, ...], float]]:
+    return lambda: {(name,): stats[stat] for name, stats in cache_stats().items()}
+
+
+Gauge("users_cache_entries", "Cached user lookups", _cache_samples("size"), ("cache",))
+cache_counters: List[Gauge] = [
+    Gauge(
+        f"users_cache_{stat}_total",
+        f"User cache {stat}",
+        _cache_samples(stat),
+        ("cache",),
+        type="counter",
+    )
+    for stat in ("hits", "misses", "evictions")
+]
+
+
+user_fields: List[Field] = [field.name for field in fields(User)]
+# Columns a next page cursor is built from
+page_keys: Tuple[Field, ...] = ("created_at", "id")
 
 
-def get_users() -> List[User]:
-    from_users_table: Callable = from_table(table_name())
-    where_is_not_deleted: Callable = where_constraint([f"deleted_at IS NULL"])
-    order_by_created_at_desc: Callable = order_by_constraint([("created_at", "DESC")])
+def page_columns(columns: Sequence[Field]) -> Tuple[Field, ...]:
+    """`columns` plus the keyset columns missing from them."""
+    return (*columns, *(key for key in page_keys if key not in columns))
+
+
+# Columns list endpoints select: what UserResponse exposes and the page keys
+list_columns: Tuple[Field, ...] = page_columns(response_fields)
+
+
+def parse_fields(fields: str) -> Tuple[Field, ...]:
+    """User columns named in a comma separated `?fields=` value.
+
+    They come back in User field order, so every selection of the same
+    columns shares one compiled query.
+    """
+    requested: List[str] = [field.strip() for field in fields.split(",")]
+    unknown: List[str] = [field for field in requested if field not in user_fields]
+    if unknown:
+        raise InvalidFields(f"Unknown fields: {', '.join(map(repr, unknown))}")
+    return tuple(field for field in user_fields if field in requested)
+
+
+# Templates by (name, *shape), each bound to the users table when compiled
+users_templates: Dict[Tuple[Hashable, ...], Template] = {}
+
+
+def users_template(
+    name: str, build: Callable[..., Query], *shape: Hashable
+) -> Template:
+    """Compiled `build(table, *shape)` for the users table.
+
+    The table is resolved when a shape is first compiled, so TEST has to be
+    set before the first query runs rather than between queries.
+    """
+    template: Optional[Template] = users_templates.get((name, *shape))
+    if template is None:
+        table: TableName = table_name()
+        template = compile_query(name, partial(build, table, *shape), table, *shape)
+        users_templates[(name, *shape)] = template
+    return template
+
+
+def encode_cursor(created_at: Union[datetime, str, None], user_id: int) -> PageCursor:
+    if isinstance(created_at, datetime):
+        created_at = created_at.isoformat()
+    return urlsafe_b64encode(f"{created_at}|{user_id}".encode()).decode()
+
+
+def decode_cursor(cursor: PageCursor) -> PageKey:
+    try:
+        created_at, user_id = urlsafe_b64decode(cursor.encode()).decode().split("|")
+        # Round trip both values so a malformed cursor fails here, not in Postgres
+        return datetime.fromisoformat(created_at).isoformat(), int(user_id)
+    except (DecodeError, UnicodeDecodeError, ValueError) as err:
+        raise InvalidCursor(f"Invalid cursor {cursor}") from err
+
+
+def select_users_query(
+    table: TableName,
+    keyset: bool = False,
+    limited: bool = False,
+    columns: Tuple[Field, ...] = tuple(user_fields),
+) -> Query:
+    """SELECT for GET /users, binding the keyset bound and then the limit."""
+    constraints: List[str] = ["deleted_at IS NULL"]
+    if keyset:
+        constraints.append(keyset_constraint(list(page_keys)))
+
+    from_users_table: Callable = from_table(table)
+    where_is_not_deleted: Callable = where_constraint(constraints)
+    order_by_created_at_desc: Callable = order_by_constraint(
+        [("created_at", "DESC"), ("id", "DESC")]
+    )
     select_all_users_query: str = order_by_created_at_desc(
-        where_is_not_deleted(from_users_table(select(__get_users_fields())))
+        where_is_not_deleted(from_users_table(select(list(columns))))
     )
-    query_result: List[Tuple] = query(select_all_users_query)
+    if limited:
+        select_all_users_query = limit_constraint(select_all_users_query)
+    return select_all_users_query
+
+
+def encode_search_cursor(rank: float, matched: str, user_id: int) -> SearchCursor:
+    return urlsafe_b64encode(f"{rank}|{user_id}|{matched}".encode()).decode()
+
+
+def decode_search_cursor(cursor: SearchCursor) -> SearchKey:
+    try:
+        # Last, since a matched name may contain the separator
+        rank, user_id, matched = (
+            urlsafe_b64decode(cursor.encode()).decode().split("|", 2)
+        )
+        return float(rank), matched, int(user_id)
+    except (DecodeError, UnicodeDecodeError, ValueError) as err:
+        raise InvalidCursor(f"Invalid cursor {cursor}") from err
+
+
+def search_columns(columns: Sequence[Field]) -> Tuple[Field, ...]:
+    """`columns` plus the id, rank and matched value that order search results."""
+    return (*columns, *(["id"] if "id" not in columns else []), "rank", "matched")
+
+
+def like_prefix(term: str) -> str:
+    """LIKE pattern matching values that start with `term`, taken literally."""
+    escaped: str = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"{escaped}%"
+
+
+# GET /users/search orders users by rank, 0 for prefix matches and otherwise
+# the trigram distance from the term to the name, then by the matched value:
+# the smallest value starting with the term, or the name for fuzzy matches
+search_keys: List[Field] = ["rank", "matched", "id"]
+order_by_search_keys: Callable = order_by_constraint(
+    [(key, "ASC") for key in search_keys]
+)
+
+
+# Columns GET /users/search matches by prefix, as the 0004 indexes store them.
+# Byte order lets LIKE 'term%' walk those indexes whatever the collation is.
+prefix_columns: Tuple[str, ...] = (
+    'lower(fullname) COLLATE "C"',
+    'lower(email) COLLATE "C"',
+    'phone_number COLLATE "C"',
+)
+
+
+def matched_prefix() -> str:
+    """The smallest value of the prefix columns starting with the term, or NULL."""
+    cases: List[str] = [
+        f"CASE WHEN {column} LIKE %s THEN {column} END" for column in prefix_columns
+    ]
+    return f"LEAST({', '.join(cases)})"
+
 
-    users: List[User] = [User(*user) for user in query_result]
+def prefix_matches_query(
+    table: TableName, column: str, keyset: bool, selected: List[Field]
+) -> Query:
+    """The first prefix matches on `column`, read in the order of its index.
+
+    Rows sorting before the bound row on another column they match were on an
+    earlier page and are skipped here too.
+    """
+    constraints: List[str] = ["deleted_at IS NULL", f"{column} LIKE %s"]
+    if keyset:
+        # Past the last prefix match the bound rank is above 0
+        constraints += ["%s::real = 0", keyset_constraint([column, "id"], False)]
+    from_users_table: Callable = from_table(table)
+    where_live_prefix: Callable = where_constraint(constraints)
+    matches: Query = where_live_prefix(
+        from_users_table(
+            select(
+                [
+                    *selected,
+                    "0::real AS rank",
+                    f"{matched_prefix()} AS matched",
+                    f"{column} AS position",
+                ]
+            )
+        )
+    )
+
+    from_matches: Callable = from_table(f"({matches}) AS matches")
+    order_by_position: Callable = order_by_constraint(
+        [("position", "ASC"), ("id", "ASC")]
+    )
+    prefix_query: Query = from_matches(select([*selected, "rank", "matched"]))
+    if keyset:
+        prefix_query = where_constraint([keyset_constraint(["matched", "id"], False)])(
+            prefix_query
+        )
+    return f"({limit_constraint(order_by_position(prefix_query))})"
+
+
+def similar_names_query(table: TableName, keyset: bool, selected: List[Field]) -> Query:
+    """The first of the closest names, read in the order of the 0005 index,
+    that the term is not a prefix of, as prefix matches rank on their own."""
+    from_users_table: Callable = from_table(table)
+    where_live_similar: Callable = where_constraint(
+        ["deleted_at IS NULL", "%s <%% lower(fullname)"]
+    )
+    closest: Query = limit_constraint(
+        order_by_constraint([("rank", "ASC")])(
+            where_live_similar(
+                from_users_table(
+                    select(
+                        [
+                            *selected,
+                            "%s <<-> lower(fullname) AS rank",
+                            'lower(fullname) COLLATE "C" AS matched',
+                            f"{matched_prefix()} AS prefix",
+                        ]
+                    )
+                )
+            )
+        )
+    )
+
+    constraints: List[str] = ["prefix IS NULL"]
+    if keyset:
+        constraints.append(keyset_constraint(search_keys, False))
+    from_closest: Callable = from_table(f"({closest}) AS closest")
+    where_not_prefix: Callable = where_constraint(constraints)
+    similar_query: Query = where_not_prefix(
+        from_closest(select([*selected, "rank", "matched"]))
+    )
+    return f"({limit_constraint(order_by_search_keys(similar_query))})"
+
+
+def search_users_query(
+    table: TableName,
+    fuzzy: bool = False,
+    keyset: bool = False,
+    columns: Tuple[Field, ...] = response_fields,
+) -> Query:
+    """SELECT for GET /users/search, best ranked first. See search_params().
+
+    Each prefix index of migration 0004, and with `fuzzy` the trigram index of
+    0005, gives its first matches past the bound row in its own order, which
+    the UNION merges. So a page reads about a page of rows per index, however
+    many users match the term.
+    """
+    selected: List[Field] = list(search_columns(columns)[:-2])
+    branches: List[Query] = [
+        prefix_matches_query(table, column, keyset, selected)
+        for column in prefix_columns
+    ]
+    if fuzzy:
+        branches.append(similar_names_query(table, keyset, selected))
+
+    from_matches: Callable = from_table(f"({' UNION '.join(branches)}) AS matches")
+    return limit_constraint(
+        order_by_search_keys(from_matches(select([*selected, "rank", "matched"])))
+    )
+
+
+def search_params(
+    term: str, fuzzy: bool, after: Optional[SearchKey], limit: int
+) -> Parameters:
+    """Parameters of search_users_query(), in the order it binds them."""
+    lowered: str = term.lower()
+    patterns: Parameters = (
+        like_prefix(lowered),
+        like_prefix(lowered),
+        like_prefix(term),
+    )
+    params: Parameters = ()
+    for prefix, pattern in zip((lowered, lowered, term), patterns):
+        params += (*patterns, pattern)
+        if after is not None:
+            rank, matched, user_id = after
+            # Bound rows sorting before the prefix would start the index walk
+            # there rather than at the first match
+            start: Tuple[str, int] = max((matched, user_id), (prefix, 0))
+            params += (rank, *start, matched, user_id)
+        params += (limit,)
+    if fuzzy:
+        params += (lowered, *patterns, lowered, search_closest_names)
+        params += (*(after or ()), limit)
+    return (*params, limit)
+
+
+def select_user_by_email_query(table: TableName) -> Query:
+    from_users_table: FromTable = from_table(table)
+    where_email_like: AddConstraintToQuery = where_constraint(["email = %s"])
+    return where_email_like(from_users_table(select(user_fields)))
+
+
+def select_user_by_id_query(
+    table: TableName, columns: Tuple[Field, ...] = tuple(user_fields)
+) -> Query:
+    from_users_table: Callable = from_table(table)
+    where_id_equals: Callable = where_constraint(["id = %s"])
+    return where_id_equals(from_users_table(select(list(columns))))
+
+
+def select_users_by_ids_query(table: TableName) -> Query:
+    from_users_table: Callable = from_table(table)
+    where_id_in: Callable = where_constraint(["id = ANY(%s)"])
+    return where_id_in(from_users_table(select(user_fields)))
+
+
+def select_users_version_query(table: TableName) -> Query:
+    """The single row of `<table>_version`, bumped by a trigger, see 0008."""
+    from_version_table: Callable = from_table(f"{table}_version")
+    return from_version_table(select(["changed_at", "version"]))
+
+
+def stream_users_query(table: TableName) -> Query:
+    from_users_table: Callable = from_table(table)
+    where_is_not_deleted: Callable = where_constraint(["deleted_at IS NULL"])
+    order_by_id: Callable = order_by_constraint([("id", "ASC")])
+    return order_by_id(where_is_not_deleted(from_users_table(select(user_fields))))
+
+
+def insert_user_query(table: TableName, keys: Tuple[Field, ...]) -> Query:
+    insert_into_users: Callable = insert_into(table)
+    user_values, _ = insert_values(dict.fromkeys(keys))
+    return insert_into_users(user_values)
+
+
+# A user needs at least one way to be reached
+contact_fields: Tuple[Field, ...] = ("email", "phone_number")
+
+
+def patch_user_query(table: TableName, keys: Tuple[Field, ...]) -> Query:
+    """UPDATE of `keys` on a live user, binding their values and then the id.
+
+    When `keys` include contact fields their new values are bound once more,
+    after the id, so the row is only updated if a contact survives the patch.
+    """
+    update_table_users: Callable = update_table(table)
+    constraints: List[str] = ["id = %s", "deleted_at IS NULL"]
+    if any(key in contact_fields for key in keys):
+        contacts: List[str] = [
+            "%s::text IS NOT NULL" if key in keys else f"{key} IS NOT NULL"
+            for key in contact_fields
+        ]
+        constraints.append(f"({' OR '.join(contacts)})")
+    where_id_is_not_deleted: Callable = where_constraint(constraints)
+    returning_user: Callable = returning(user_fields)
+    update_user_values, _ = update_values(dict.fromkeys(keys))
+    return returning_user(
+        where_id_is_not_deleted(update_table_users(update_user_values))
+    )
+
+
+def compile_user_queries() -> List[Template]:
+    """Compile the fixed query shapes ahead of the first request."""
+    all_columns: Tuple[Field, ...] = tuple(user_fields)
+    return [
+        users_template("get_users", select_users_query, False, False, all_columns),
+        users_template("get_users", select_users_query, False, True, all_columns),
+        users_template("get_users", select_users_query, True, True, all_columns),
+        users_template("get_users", select_users_query, False, True, list_columns),
+        users_template("get_users", select_users_query, True, True, list_columns),
+        users_template("get_user_by_email", select_user_by_email_query),
+        users_template("get_user_by_id", select_user_by_id_query),
+        users_template("get_users_by_ids", select_users_by_ids_query),
+        users_template("get_users_version", select_users_version_query),
+        users_template("stream_users", stream_users_query),
+    ]
+
+
+def get_users_rows(
+    limit: Optional[int] = None,
+    after: Optional[PageKey] = None,
+    columns: Tuple[Field, ...] = tuple(user_fields),
+) -> QueryResult:
+    """Rows of live users, newest first, with only `columns` selected."""
+    params: Parameters = ()
+    if after is not None:
+        params += after
+    if limit is not None:
+        params += (limit,)
+
+    select_all_users: Template = users_template(
+        "get_users", select_users_query, after is not None, limit is not None, columns
+    )
+    return select_all_users(params)
+
+
+def get_users(
+    limit: Optional[int] = None, after: Optional[PageKey] = None
+) -> List[User]:
+    users: List[User] = [User(*user) for user in get_users_rows(limit, after)]
     return users
 
 
+def get_users_rows_page(
+    limit: int,
+    cursor: Optional[PageCursor] = None,
+    columns: Tuple[Field, ...] = list_columns,
+) -> Tuple[QueryResult, Optional[PageCursor]]:
+    """A page of rows with `page_columns(columns)` as columns."""
+    after: Optional[PageKey] = decode_cursor(cursor) if cursor else None
+    selected: Tuple[Field, ...] = page_columns(columns)
+    # One extra row tells whether there is a next page without a COUNT
+    rows: QueryResult = get_users_rows(limit + 1, after, selected)
+    if len(rows) <= limit:
+        return rows, None
+
+    page: QueryResult = rows[:limit]
+    created_at, user_id = (page[-1][selected.index(key)] for key in page_keys)
+    return page, encode_cursor(created_at, user_id)
+
+
+def get_users_page(
+    limit: int, cursor: Optional[PageCursor] = None
+) -> Tuple[List[User], Optional[PageCursor]]:
+    rows, next_cursor = get_users_rows_page(limit, cursor, tuple(user_fields))
+    return [User(*user) for user in rows], next_cursor
+
+
+@lru_cache(maxsize=None)
+def trigram_search() -> bool:
+    """Whether fuzzy search is on and pg_trgm is installed to serve it."""
+    if not search_fuzzy:
+        return False
+    installed: Template = compile_query(
+        "pg_trgm_installed",
+        lambda: "SELECT COUNT(*) FROM pg_extension WHERE extname = 'pg_trgm'",
+    )
+    return installed()[0][0] > 0
+
+
+def search_users_rows(
+    term: str,
+    limit: int,
+    cursor: Optional[SearchCursor] = None,
+    columns: Tuple[Field, ...] = response_fields,
+) -> Tuple[QueryResult, Optional[SearchCursor]]:
+    """A page of the live users matching `term`, with `search_columns(columns)`.
+
+    Names, emails and phone numbers match by prefix, case insensitively, and
+    names also by similarity where pg_trgm is installed.
+    """
+    after: Optional[SearchKey] = decode_search_cursor(cursor) if cursor else None
+    fuzzy: bool = trigram_search()
+    search: Template = users_template(
+        "search_users", search_users_query, fuzzy, after is not None, columns
+    )
+    # One extra row tells whether there is a next page without a COUNT
+    rows: QueryResult = search(search_params(term, fuzzy, after, limit + 1))
+    if len(rows) <= limit:
+        return rows, None
+
+    page: QueryResult = rows[:limit]
+    selected: Tuple[Field, ...] = search_columns(columns)
+    rank, matched, user_id = (page[-1][selected.index(key)] for key in search_keys)
+    return page, encode_search_cursor(rank, matched, user_id)
+
+
+def get_users_version() -> UsersVersion:
+    """A one row probe that changes whenever a statement writes to the users.
+
+    The version commits together with the write that bumped it, so a reader
+    never sees a new version before the rows it stands for.
+    """
+    select_users_version: Template = users_template(
+        "get_users_version", select_users_version_query
+    )
+    changed_at, version = select_users_version()[0]
+    return changed_at, version
+
+
+def stream_users(itersize: int = default_itersize) -> Iterator[User]:
+    stream_all_users: Template = users_template("stream_users", stream_users_query)
+    return (User(*user) for user in stream(stream_all_users.query, (), itersize))
+
+
 def get_user_by_email(email: str) -> User:
-    from_users_table: FromTable = from_table(table_name())
-    where_email_like: AddConstraintToQuery = where_constraint([f"email = '{email}'"])
-    select_user_by_email: Query = where_email_like(
-        from_users_table(select(__get_users_fields()))
+    table: str = table_name()
+    user_id = _cached(user_ids_by_email, (table, email))
+    if user_id is NOT_FOUND:
+        raise UserNotFound(f"User not found with email {email}")
+    if not isinstance(user_id, int):
+        return _get_user_by_email(email)
+
+    user = _cached(users_by_id, (table, user_id))
+    if isinstance(user, User) and user.email == email:
+        return replace(user)
+    return _get_user_by_email(email)
+
+
+def _get_user_by_email(email: str) -> User:
+    table: str = table_name()
+    try:
+        user: User = _select_user_by_email(email)
+    except UserNotFound:
+        _cache(user_ids_by_email, (table, email), NOT_FOUND, cache_negative_ttl)
+        raise
+
+    if user.id is not None:
+        _cache(user_ids_by_email, (table, email), user.id)
+        _cache(users_by_id, (table, user.id), user)
+    return replace(user)
+
+
+def _select_user_by_email(email: str) -> User:
+    select_user_by_email: Template = users_template(
+        "get_user_by_email", select_user_by_email_query
     )
-    query_result: QueryResult = query(select_user_by_email)
+    query_result: QueryResult = select_user_by_email((email,))
     if not query_result:
         raise UserNotFound(f"User not found with email {email}")
 
@@ -73,13 +681,28 @@ def get_user_by_email(email: str) -> User:
 
 
 def get_user_by_id(id: int) -> User:
-    from_users_table: Callable = from_table(table_name())
-    where_id_equals: Callable = where_constraint([f"id = {id}"])
-    select_user_by_id: str = where_id_equals(
-        from_users_table(select(__get_users_fields()))
-    )
+    table: str = table_name()
+    user = _cached(users_by_id, (table, id))
+    if user is NOT_FOUND:
+        raise UserNotFound(f"User not found with id {id}")
+    if user is not MISSING:
+        return replace(user)
+
+    try:
+        user = _select_user_by_id(id)
+    except UserNotFound:
+        _cache(users_by_id, (table, id), NOT_FOUND, cache_negative_ttl)
+        raise
 
-    query_result: List[Tuple] = query(select_user_by_id)
+    _cache(users_by_id, (table, id), user)
+    return replace(user)
+
+
+def _select_user_by_id(id: int) -> User:
+    select_user_by_id: Template = users_template(
+        "get_user_by_id", select_user_by_id_query
+    )
+    query_result: List[Tuple] = select_user_by_id((id,))
     if not query_result:
         raise UserNotFound(f"User not found with id {id}")
 
@@ -89,64 +712,345 @@ def get_user_by_id(id: int) -> User:
     return User(*query_result[0])
 
 
+def get_users_by_ids(ids: Sequence[int]) -> Dict[int, User]:
+    """The users with any of `ids`, by id, selecting all cache misses at once."""
+    table: str = table_name()
+    found: Dict[int, User] = {}
+    missing: List[int] = []
+    for user_id in dict.fromkeys(ids):
+        user = _cached(users_by_id, (table, user_id))
+        if user is MISSING:
+            missing.append(user_id)
+        elif user is not NOT_FOUND:
+            found[user_id] = replace(user)
+    if not missing:
+        return found
+
+    select_users_by_ids: Template = users_template(
+        "get_users_by_ids", select_users_by_ids_query
+    )
+    for row in select_users_by_ids((missing,)):
+        user = User(*row)
+        _cache(users_by_id, (table, user.id), user)
+        found[user.id] = replace(user)
+    for user_id in missing:
+        if user_id not in found:
+            _cache(users_by_id, (table, user_id), NOT_FOUND, cache_negative_ttl)
+    return found
+
+
+def warm_user_cache(count: int = cache_warm) -> int:
+    """Cache the `count` newest users, returning how many were cached.
+
+    They are read from the primary, so they are cached for the whole ttl.
+    """
+    if count <= 0:
+        return 0
+    table: str = table_name()
+    with primary_reads():
+        users: List[User] = get_users(min(count, cache_size))
+        for user in users:
+            _cache(users_by_id, (table, user.id), user)
+    return len(users)
+
+
+def get_user_row_by_id(id: int, columns: Tuple[Field, ...]) -> Tuple:
+    """`columns` of a user, read from the cache or selected on their own."""
+    table: str = table_name()
+    user = _cached(users_by_id, (table, id))
+    if user is NOT_FOUND:
+        raise UserNotFound(f"User not found with id {id}")
+    if user is not MISSING:
+        return tuple(getattr(user, column) for column in columns)
+
+    select_user_by_id: Template = users_template(
+        "get_user_by_id", select_user_by_id_query, columns
+    )
+    query_result: List[Tuple] = select_user_by_id((id,))
+    if not query_result:
+        _cache(users_by_id, (table, id), NOT_FOUND, cache_negative_ttl)
+        raise UserNotFound(f"User not found with id {id}")
+
+    if len(query_result) > 1:
+        raise DuplicateID(f"More than one user with id {id}")
+
+    return query_result[0]
+
+
 def insert_user(user: User) -> User:
-    insert_into_users: Callable = insert_into(table_name())
-    insert_user_query: str = insert_into_users(insert_values(user.insert_dict()))
-    result = query(insert_user_query)
+    values: dict = user.insert_dict()
+    insert_into_users: Template = users_template(
+        "insert_user", insert_user_query, tuple(values)
+    )
+    result = insert_into_users(tuple(values.values()))
     if result and len(result) == 1:
         user.id = result[0][0]  # First element of the list of tuples
+        invalidate_user(user.id, user.email)
         return user
 
     raise Exception("Unexpected issue creating a user")
 
 
+def insert_users(users: List[User]) -> List[Union[User, Exception]]:
+    """Insert `users` in one transaction, returning each user or its error."""
+    results = insert_many(table_name(), [user.insert_dict() for user in users])
+    inserted: List[Union[User, Exception]] = []
+    for user, result in zip(users, results):
+        if isinstance(result, Exception):
+            inserted.append(result)
+            continue
+
+        user.id = result[0]
+        invalidate_user(user.id, user.email)
+        inserted.append(user)
+    return inserted
+
+
+def _is_live(user_id: int) -> bool:
+    select_user_by_id: Template = users_template(
+        "get_user_by_id", select_user_by_id_query
+    )
+    rows: QueryResult = select_user_by_id((user_id,))
+    return bool(rows) and User(*rows[0]).deleted_at is None
+
+
+def patch_user(user_id: int, changes: dict) -> User:
+    """Apply `changes` to a non-deleted user in a single UPDATE ... RETURNING."""
+    update: dict = {**changes, "updated_at": str(datetime.now(timezone.utc))}
+    update_user: Template = users_template(
+        "patch_user", patch_user_query, tuple(update)
+    )
+    contacts: Parameters = tuple(update[key] for key in contact_fields if key in update)
+    try:
+        result: QueryResult = update_user((*update.values(), user_id, *contacts))
+    except CheckViolation as err:
+        raise MissingRequiredField("Phone Number or email is required") from err
+    if not result:
+        if contacts and _is_live(user_id):
+            raise MissingRequiredField("Phone Number or email is required")
+        raise UserNotFound(f"User not found with id {user_id}")
+
+    user: User = User(*result[0])
+    # The old email mapping goes stale on its own once the id entry is gone
+    invalidate_user(user_id, user.email)
+    return user
+
+
 def update_user(user: User) -> User:
     if user.id is None:
         raise Exception("No id in update request")
 
-    user.updated_at = str(datetime.now(timezone.utc))
-    og_user_dict: dict = get_user_by_id(user.id).update_dict()
-    update: dict = {
-        key: value
-        for key, value in user.update_dict().items()
-        if value != og_user_dict[key]
-    }
-    update_table_users: Callable = update_table(table_name())
-    update_user: Callable = update_table_users(user.id)
-    update_user_values = update_values(update)
-    update_user_query: str = update_user(update_user_values)
-    result = query(update_user_query)
-    if result and len(result) == 1:
-        user.id = result[0][0]
-        return user
-
-    raise Exception(f"Unexpected issue while updating the user: {user.id}")
+    return patch_user(user.id, user.insert_dict())
 
 
 def delete_user(user_id: int) -> None:
-    user: User = get_user_by_id(user_id)
-    user.deleted_at = str(datetime.now(timezone.utc))
-    update_user(user)
+    patch_user(user_id, {"deleted_at": str(datetime.now(timezone.utc))})
     return
 
 
+reads = SingleFlight()
+
+
+async def _read(name: str, blocking: Callable[..., T], *args: Hashable) -> T:
+    """run_async(blocking, *args), shared with an identical read in flight."""
+    call: Callable[[], Awaitable[T]] = partial(run_async, blocking, *args)
+    # Sessions pinned to the primary only share reads with each other
+    key: Hashable = (table_name(), reads_from_primary(), *args)
+    return await reads.do(name, key, call)
+
+
+async def get_users_async() -> List[User]:
+    return await _read("get_users", get_users)
+
+
+async def get_users_rows_page_async(
+    limit: int,
+    cursor: Optional[PageCursor] = None,
+    columns: Tuple[Field, ...] = list_columns,
+) -> Tuple[QueryResult, Optional[PageCursor]]:
+    return await _read(
+        "get_users_rows_page", get_users_rows_page, limit, cursor, columns
+    )
+
+
+async def search_users_rows_async(
+    term: str,
+    limit: int,
+    cursor: Optional[SearchCursor] = None,
+    columns: Tuple[Field, ...] = response_fields,
+) -> Tuple[QueryResult, Optional[SearchCursor]]:
+    return await _read(
+        "search_users_rows", search_users_rows, term, limit, cursor, columns
+    )
+
+
+async def get_users_version_async() -> UsersVersion:
+    return await _read("get_users_version", get_users_version)
+
+
+async def get_users_page_async(
+    limit: int, cursor: Optional[PageCursor] = None
+) -> Tuple[List[User], Optional[PageCursor]]:
+    return await _read("get_users_page", get_users_page, limit, cursor)
+
+
+async def stream_users_async(
+    chunk_size: int = default_itersize,
+) -> AsyncIterator[List[User]]:
+    """Yield users in chunks, fetching each chunk on the database executor."""
+    users: Iterator[User] = stream_users(chunk_size)
+    # A cancelled fetch keeps running on its thread, so closing must wait for it
+    lock = Lock()
+
+    def next_chunk() -> List[User]:
+        with lock:
+            return list(islice(users, chunk_size))
+
+    def close() -> None:
+        with lock:
+            users.close()
+
+    try:
+        while True:
+            chunk: List[User] = await run_async(next_chunk)
+            if not chunk:
+                return
+            yield chunk
+    finally:
+        await run_async(close)
+
+
+async def get_user_by_email_async(email: str) -> User:
+    return replace(await _read("get_user_by_email", get_user_by_email, email))
+
+
+async def _load_users_by_ids(ids: List[int]) -> List[Union[User, Exception]]:
+    users: Dict[int, User] = await run_async(get_users_by_ids, ids)
+    return [
+        replace(users[id])
+        if id in users
+        else UserNotFound(f"User not found with id {id}")
+        for id in ids
+    ]
+
+
+user_loader: Batcher[int, User] = Batcher(
+    "users_by_id", _load_users_by_ids, loader_window, loader_max_batch
+)
+
+
+async def get_user_by_id_async(id: int) -> User:
+    """A user from the cache, or from a query batched with concurrent misses."""
+    user = _cached(users_by_id, (table_name(), id))
+    if user is NOT_FOUND:
+        raise UserNotFound(f"User not found with id {id}")
+    if user is not MISSING:
+        return replace(user)
+    if reads_from_primary():
+        return await run_async(get_user_by_id, id)
+    load: Callable[[], Awaitable[User]] = partial(user_loader.load, id)
+    return replace(await reads.do("get_user_by_id", (table_name(), id), load))
+
+
+async def get_users_by_ids_async(ids: Sequence[int]) -> Dict[int, User]:
+    return await _read("get_users_by_ids", get_users_by_ids, tuple(ids))
+
+
+async def get_user_row_by_id_async(id: int, columns: Tuple[Field, ...]) -> Tuple:
+    return await _read("get_user_row_by_id", get_user_row_by_id, id, columns)
+
+
+async def insert_users_async(users: List[User]) -> List[Union[User, Exception]]:
+    return await run_async(insert_users, users)
+
+
+user_inserter: Batcher[User, User] = Batcher(
+    "insert_user", insert_users_async, inserter_window, inserter_max_batch
+)
+
+
+async def insert_user_async(user: User) -> User:
+    """Insert `user`, together with concurrent inserts when batching is on.
+
+    A batch commits once, and a row that fails only fails its own caller.
+    """
+    if user_inserter.window <= 0:
+        return await run_async(insert_user, user)
+    inserted: User = await user_inserter.load(user)
+    # The batch ran in the session of whichever caller started it
+    mark_written()
+    return inserted
+
+
+async def update_user_async(user: User) -> User:
+    return await run_async(update_user, user)
+
+
+async def patch_user_async(user_id: int, changes: dict) -> User:
+    return await run_async(patch_user, user_id, changes)
+
+
+async def delete_user_async(user_id: int) -> None:
+    return await run_async(delete_user, user_id)
+
+
 if __name__ == "__main__":
 
     import os
     from copy import deepcopy
 
-    from utils.test_server import test_create_data, test_delete_data
+    from utils.cache import clear_caches
+    from utils.metrics import render
+    from utils.test_server import transactional
 
     os.environ["TEST"] = "True"
 
-    @test_create_data("users")
-    @test_delete_data("users")
+    @transactional("users")
     def _test_get_users():
         users: List[User] = get_users()
         assert len(users) >= 6
 
-    @test_create_data("users")
-    @test_delete_data("users")
+    @transactional("users")
+    def _test_get_users_page():
+        users: List[User] = get_users()
+        first_page, cursor = get_users_page(2)
+        assert [user.id for user in first_page] == [user.id for user in users[:2]]
+        assert cursor is not None
+
+        second_page, _ = get_users_page(2, cursor)
+        assert [user.id for user in second_page] == [user.id for user in users[2:4]]
+
+        _, last_cursor = get_users_page(len(users))
+        assert last_cursor is None
+
+    @transactional("users")
+    def _test_sparse_fields():
+        assert parse_fields("id, email") == ("email", "id")
+        try:
+            parse_fields("id,password")
+        except InvalidFields:
+            pass
+        else:
+            raise Exception("Unknown field accepted")
+
+        user: User = get_users()[0]
+        if user.id is None:
+            raise Exception("ERROR NO ID IN USER")
+        columns: Tuple[Field, ...] = parse_fields("email")
+        rows, _ = get_users_rows_page(1, None, columns)
+        assert len(rows[0]) == len(page_columns(columns))
+        clear_caches()
+        assert get_user_row_by_id(user.id, columns) == (user.email,)
+        get_user_by_id(user.id)
+        assert get_user_row_by_id(user.id, ("id", "email")) == (user.id, user.email)
+
+    @transactional("users")
+    def _test_stream_users():
+        users: List[User] = get_users()
+        streamed_users: List[User] = list(stream_users(itersize=2))
+        assert {user.id for user in streamed_users} == {user.id for user in users}
+
+    @transactional("users")
     def _test_get_user_by_id():
         users: List[User] = get_users()
         user_id = users[0].id
@@ -159,8 +1063,79 @@ if __name__ == "__main__":
         assert user_1.id == user_id
         assert user_2.id == user_id_2
 
-    @test_create_data("users")
-    @test_delete_data("users")
+    @transactional("users")
+    def _test_get_users_by_ids():
+        import asyncio
+
+        users: List[User] = get_users()
+        ids: List[int] = [user.id for user in users[:3] if user.id is not None]
+        found: Dict[int, User] = get_users_by_ids([*ids, ids[0], -1])
+        assert sorted(found) == sorted(ids)
+        assert users_by_id.get((table_name(), -1)) is NOT_FOUND
+
+        async def _load_concurrently() -> List[Union[User, BaseException]]:
+            return await asyncio.gather(
+                *(get_user_by_id_async(id) for id in [*ids, -2]),
+                return_exceptions=True,
+            )
+
+        clear_caches()
+        select_users_by_ids: Template = users_template(
+            "get_users_by_ids", select_users_by_ids_query
+        )
+        calls: int = select_users_by_ids.calls
+        results = asyncio.run(_load_concurrently())
+        assert [user.id for user in results[:3]] == ids
+        assert isinstance(results[3], UserNotFound)
+        assert select_users_by_ids.calls == calls + 1
+        assert (
+            f'db_template_calls_total{{template="{select_users_by_ids.label}"}} '
+            f"{calls + 1}" in render()
+        )
+
+    @transactional("users")
+    def _test_get_users_version():
+        changed_at, version = get_users_version()
+        assert get_users_version() == (changed_at, version)
+        patch_user(get_users(1)[0].id, {"fullname": "test_versioned_user"})
+        later_changed_at, later_version = get_users_version()
+        assert later_version > version and later_changed_at >= changed_at
+
+    @transactional("users")
+    def _test_warm_user_cache():
+        assert warm_user_cache(0) == 0
+        newest: List[User] = get_users(2)
+        assert warm_user_cache(2) == 2
+        for user in newest:
+            assert users_by_id.get((table_name(), user.id)) == user
+
+    @transactional("users")
+    def _test_search_users_rows():
+        rows, cursor = search_users_rows("test_Wenceslao", 5, columns=("email",))
+        assert len(rows) == 5 and cursor is not None
+        assert all(len(row) == len(search_columns(("email",))) for row in rows)
+        ranked: List[Tuple] = [(row[2], row[3], row[1]) for row in rows]
+        assert ranked == sorted(ranked) and ranked[0][:2] == (0, "test_wenceslao")
+
+        rest, cursor = search_users_rows("test_Wenceslao", 5, cursor, ("email",))
+        assert len(rest) == 1 and cursor is None
+        assert (rest[0][2], rest[0][3], rest[0][1]) > ranked[-1]
+
+        # A bound row sorting before the prefix skips none of its matches
+        before: SearchCursor = encode_search_cursor(0.0, "a|b", 0)
+        assert decode_search_cursor(before) == (0.0, "a|b", 0)
+        page, _ = search_users_rows("test_Wenceslao3", 5, before, ("email",))
+        assert [row[0] for row in page if row[2] == 0] == ["testmail4@gmail.com"]
+
+        assert search_users_rows("nobody", 5)[0] == []
+        try:
+            search_users_rows("test", 5, "garbage")
+        except InvalidCursor:
+            pass
+        else:
+            raise Exception("Invalid cursor was accepted")
+
+    @transactional("users")
     def _test_insert_user():
         user: User = User(
             fullname="test_insert",
@@ -174,8 +1149,64 @@ if __name__ == "__main__":
         found_user = get_user_by_id(new_id)
         assert found_user.fullname == user.fullname
 
-    @test_create_data("users")
-    @test_delete_data("users")
+    @transactional("users")
+    def _test_insert_user_batches():
+        import asyncio
+
+        from database.database import DriverError
+        from utils.batch import batch_sizes
+
+        users: List[User] = [
+            User(
+                fullname=f"test_batched_{idx}",
+                email=f"test_batched_{idx}@insert.com",
+                phone_number="3333333333",
+            )
+            for idx in range(3)
+        ]
+        duplicate: User = User(
+            fullname="test_batched_duplicate",
+            email="test_batched_0@insert.com",
+            phone_number="3333333333",
+        )
+
+        async def _insert_concurrently() -> List[Union[User, BaseException]]:
+            return await asyncio.gather(
+                *(insert_user_async(user) for user in [*users, duplicate]),
+                return_exceptions=True,
+            )
+
+        user_inserter.window = 0.01
+        try:
+            results = asyncio.run(_insert_concurrently())
+        finally:
+            user_inserter.window = inserter_window
+        assert all(isinstance(result, User) for result in results[:3])
+        assert isinstance(results[3], DriverError)
+        assert get_user_by_id(results[2].id).email == "test_batched_2@insert.com"
+        assert 'batch_size_sum{batcher="insert_user"} 4' in batch_sizes.render()
+
+    @transactional("users")
+    def _test_insert_users():
+        users: List[User] = [
+            User(
+                fullname=f"test_bulk_{idx}",
+                email=f"test_bulk_{idx}@insert.com",
+                phone_number="3333333333",
+            )
+            for idx in range(3)
+        ]
+        duplicate: User = User(
+            fullname="test_bulk_duplicate",
+            email="test_bulk_0@insert.com",
+            phone_number="3333333333",
+        )
+        results = insert_users(users + [duplicate])
+        assert all(isinstance(result, User) for result in results[:3])
+        assert isinstance(results[3], Exception)
+        assert get_user_by_email("test_bulk_2@insert.com").id == results[2].id
+
+    @transactional("users")
     def _test_update_user():
         users: List[User] = get_users()
         og_user: User = users[0]
@@ -185,8 +1216,35 @@ if __name__ == "__main__":
         assert updated_user.id == og_user.id == user_to_update.id
         assert updated_user.fullname == user_to_update.fullname != og_user.fullname
 
-    @test_create_data("users")
-    @test_delete_data("users")
+    @transactional("users")
+    def _test_patch_user():
+        og_user: User = get_users()[0]
+        if og_user.id is None:
+            raise Exception("ERROR NO ID IN USER")
+
+        patched_user: User = patch_user(og_user.id, {"fullname": "test_patched_user"})
+        assert patched_user.fullname == "test_patched_user"
+        assert patched_user.email == og_user.email
+
+        patched_user = patch_user(og_user.id, {"phone_number": None})
+        assert patched_user.phone_number is None
+        try:
+            patch_user(og_user.id, {"email": None})
+        except MissingRequiredField:
+            pass
+        else:
+            raise Exception("Patched away the last contact of a user")
+        assert get_user_by_id(og_user.id).email == og_user.email
+
+        delete_user(og_user.id)
+        try:
+            patch_user(og_user.id, {"email": None})
+        except UserNotFound:
+            pass
+        else:
+            raise Exception("Patched a deleted user")
+
+    @transactional("users")
     def _test_delete_user():
         users: List[User] = get_users()
         first_user: User = users[0]
@@ -200,8 +1258,7 @@ if __name__ == "__main__":
         users_after_delete: List[User] = get_users()
         assert (len(users) - len(users_after_delete)) == 2
 
-    @test_create_data("users")
-    @test_delete_data("users")
+    @transactional("users")
     def _test_get_user_by_email():
         users: List[User] = get_users()
         user: User = users[0]
@@ -209,9 +1266,136 @@ if __name__ == "__main__":
         assert user.id == user_by_email.id
         assert user.email == user_by_email.email
 
+    @transactional("users")
+    def _test_get_user_by_email_is_parameterized():
+        try:
+            get_user_by_email("nobody@gmail.com' OR '1' = '1")
+        except UserNotFound:
+            return
+        raise Exception("Email was interpolated into the query")
+
+    @transactional("users")
+    def _test_cached_reads_are_invalidated():
+        user: User = get_users()[0]
+        if user.id is None:
+            raise Exception("ERROR NO ID IN USER")
+
+        assert get_user_by_id(user.id).fullname == user.fullname
+        assert get_user_by_email(user.email).id == user.id
+        hits: int = users_by_id.hits
+        get_user_by_id(user.id)
+        assert users_by_id.hits == hits + 1
+
+        patch_user(user.id, {"fullname": "test_cached_user", "email": "test_c@c.com"})
+        assert get_user_by_id(user.id).fullname == "test_cached_user"
+        assert get_user_by_email("test_c@c.com").id == user.id
+        try:
+            get_user_by_email(user.email)
+        except UserNotFound:
+            return
+        raise Exception("Stale email mapping served from the cache")
+
+    @transactional("users")
+    def _test_concurrent_reads():
+        import asyncio
+
+        async def _read_concurrently() -> List[List[User]]:
+            return await asyncio.gather(*[get_users_async() for _ in range(10)])
+
+        from utils.singleflight import singleflight_collapsed
+
+        collapsed: float = singleflight_collapsed.totals().get(("get_users",), 0)
+        results: List[List[User]] = asyncio.run(_read_concurrently())
+        assert len(results) == 10
+        assert all(len(users) == len(results[0]) for users in results)
+        # One query ran and the other nine reads awaited it
+        assert singleflight_collapsed.totals()[("get_users",)] == collapsed + 9
+
+    @transactional("users")
+    def _test_replica_routing():
+        from contextlib import contextmanager
+        from contextvars import Token
+        from time import monotonic
+
+        from psycopg2 import OperationalError
+
+        import database.database as database
+        from database.replicas import ReplicaSet, begin_session, session
+
+        class _Replica:
+            """Stands in for a replica, counting the reads it serves."""
+
+            def __init__(self, fail: bool = False) -> None:
+                self.fail = fail
+                self.reads = 0
+                self.in_use = 0
+
+            @contextmanager
+            def connection(self):
+                if self.fail:
+                    raise OperationalError("replica is down")
+                self.reads += 1
+                with database.default_pool.connection() as connection:
+                    yield connection
+
+        down, up = _Replica(fail=True), _Replica()
+        replicas: ReplicaSet = database.replicas
+        database.replicas = ReplicaSet([down, up], retry_after=60)  # type: ignore
+        token: Token = begin_session()
+        try:
+            # The first read fails over to the primary and takes `down` out
+            for _ in range(3):
+                assert len(get_users(1)) == 1
+            assert (down.reads, up.reads) == (0, 2)
+
+            # What replicas return is cached briefly, they may lag behind a write
+            first: User = get_users(1)[0]
+            assert get_user_by_id(first.id) == first
+            expires_at, cached = users_by_id._entries[(table_name(), first.id)]
+            assert cached == first
+            assert expires_at <= monotonic() + cache_replica_ttl
+            assert up.reads == 4
+
+            # Warming reads from the primary and caches for the whole ttl
+            users_by_id.clear()
+            assert warm_user_cache(1) == 1
+            assert up.reads == 4
+            expires_at, _ = users_by_id._entries[(table_name(), first.id)]
+            assert expires_at > monotonic() + cache_replica_ttl
+
+            user: User = User(
+                fullname="test_replica",
+                email="test_replica@insert.com",
+                phone_number="3333333333",
+            )
+            insert_user(user)
+            # Read your writes: the session now reads from the primary
+            assert get_users(1)[0].email == user.email
+            # and skips the cache, which may hold what it read before writing
+            users_by_id.set((table_name(), first.id), replace(first, fullname="stale"))
+            assert get_user_by_id(first.id).fullname == first.fullname
+            assert up.reads == 4
+        finally:
+            session.reset(token)
+            database.replicas = replicas
+
     _test_get_users()
+    _test_get_users_page()
+    _test_sparse_fields()
+    _test_stream_users()
     _test_get_user_by_id()
+    _test_get_users_by_ids()
+    _test_get_users_version()
+    _test_warm_user_cache()
+    _test_search_users_rows()
     _test_insert_user()
+    _test_insert_users()
+    _test_insert_user_batches()
     _test_update_user()
+    _test_patch_user()
     _test_delete_user()
     _test_get_user_by_email()
+    _test_get_user_by_email_is_parameterized()
+    _test_cached_reads_are_invalidated()
+    _test_concurrent_reads()
+    _test_replica_routing()
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""Move users soft deleted longer than the retention period to the archive.
+
+Runs batch after batch, each in its own short transaction and with a pause
+in between, until there is nothing left to archive or --max-batches is hit.
+
+    python utils/archive_users.py [--retention-days N] [--vacuum]
+"""
+import os
+import sys
+from argparse import ArgumentParser
+
+root: str = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, root)
+
+from users.archive import (
+    archive_after,
+    archive_batch_size,
+    archive_deleted_users,
+    archive_pause,
+    vacuum_users,
+)
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--retention-days", type=float, default=archive_after / (24 * 3600)
+    )
+    parser.add_argument("--batch-size", type=int, default=archive_batch_size)
+    parser.add_argument(
+        "--pause", type=float, default=archive_pause, help="seconds between batches"
+    )
+    parser.add_argument("--max-batches", type=int, default=None)
+    parser.add_argument(
+        "--vacuum",
+        action="store_true",
+        help="VACUUM ANALYZE the users table afterwards",
+    )
+    args = parser.parse_args()
+
+    archived: int = archive_deleted_users(
+        args.retention_days * 24 * 3600, args.batch_size, args.pause, args.max_batches
+    )
+    print(f"Archived {archived} users")
+    if args.vacuum and archived:
+        vacuum_users()
@@ -0,0 +1,122 @@
+from __future__ import annotations
+
+from asyncio import AbstractEventLoop, Future, Handle, Task, get_running_loop
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Generic, List, Optional, Set, TypeVar, Union
+from weakref import WeakKeyDictionary
+
+from utils.metrics import Histogram
+
+K = TypeVar("K")
+V = TypeVar("V")
+
+BatchLoader = Callable[[List[K]], Awaitable[List[Union[V, Exception]]]]
+
+batch_sizes = Histogram(
+    "batch_size",
+    "Keys sent together by each batcher",
+    ("batcher",),
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000),
+)
+
+
+@dataclass
+class _Batch(Generic[K, V]):
+    keys: List[K] = field(default_factory=list)
+    futures: List[Future] = field(default_factory=list)
+    handle: Optional[Handle] = None
+
+
+class Batcher(Generic[K, V]):
+    """Coalesce concurrent `load(key)` calls into one `load_batch(keys)` call.
+
+    A batch is sent `window` seconds after its first key arrives, or as soon
+    as it holds `max_size` keys. `load_batch` returns one result per key, in
+    order; an Exception result is raised to the caller of that key only.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        load_batch: BatchLoader,
+        window: float = 0.002,
+        max_size: int = 100,
+    ) -> None:
+        self.name = name
+        self.load_batch = load_batch
+        self.window = window
+        self.max_size = max_size
+        self._batches: WeakKeyDictionary[
+            AbstractEventLoop, _Batch
+        ] = WeakKeyDictionary()
+        # The loop only keeps weak references to tasks
+        self._tasks: Set[Task] = set()
+
+    async def load(self, key: K) -> V:
+        loop: AbstractEventLoop = get_running_loop()
+        batch: Optional[_Batch] = self._batches.get(loop)
+        if batch is None:
+            batch = self._batches[loop] = _Batch()
+            batch.handle = loop.call_later(self.window, self._dispatch, loop)
+
+        future: Future = loop.create_future()
+        batch.keys.append(key)
+        batch.futures.append(future)
+        if len(batch.keys) >= self.max_size:
+            self._dispatch(loop)
+        return await future
+
+    def _dispatch(self, loop: AbstractEventLoop) -> None:
+        batch: Optional[_Batch] = self._batches.pop(loop, None)
+        if batch is None:
+            return
+        if batch.handle is not None:
+            batch.handle.cancel()
+
+        batch_sizes.observe(len(batch.keys), self.name)
+        task: Task = loop.create_task(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: _Batch) -> None:
+        try:
+            results: List[Union[V, Exception]] = await self.load_batch(batch.keys)
+        except Exception as err:
+            results = [err] * len(batch.keys)
+
+        for future, result in zip(batch.futures, results):
+            if future.done():  # the caller was cancelled
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+
+if __name__ == "__main__":
+    from asyncio import gather, run, sleep
+
+    def _test_concurrent_loads_are_batched():
+        calls: List[List[int]] = []
+
+        async def load_batch(keys: List[int]) -> List[Union[int, Exception]]:
+            calls.append(keys)
+            return [KeyError(key) if key < 0 else key * 2 for key in keys]
+
+        async def main() -> None:
+            batcher: Batcher[int, int] = Batcher("test", load_batch, max_size=3)
+            results = await gather(
+                *(batcher.load(key) for key in (1, 2, -1, 3)), return_exceptions=True
+            )
+            assert results[:2] == [2, 4]
+            assert isinstance(results[2], KeyError)
+            assert results[3] == 6
+            assert calls == [[1, 2, -1], [3]]
+
+            await sleep(0.01)
+            assert await batcher.load(4) == 8
+            assert calls[-1] == [4]
+
+        run(main())
+
+    _test_concurrent_loads_are_batched()
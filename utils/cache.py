@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+from typing import Any, Dict, Generic, Hashable, Tuple, TypeVar, Union
+from weakref import WeakSet
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class Missing:
+    """Sentinel returned by TTLCache.get on a miss."""
+
+    def __repr__(self) -> str:
+        return "MISSING"
+
+
+MISSING = Missing()
+
+_caches: WeakSet[TTLCache] = WeakSet()
+
+
+class TTLCache(Generic[K, V]):
+    """Bounded, thread safe LRU cache whose entries expire after a TTL.
+
+    Expired entries are dropped lazily when they are read or when they reach
+    the LRU end of the cache.
+    """
+
+    def __init__(self, max_size: int, ttl: float) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict[K, Tuple[float, V]] = OrderedDict()
+        self._lock = Lock()
+        _caches.add(self)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: K) -> Union[V, Missing]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return MISSING
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: K, value: V, ttl: Union[float, None] = None) -> None:
+        if self.max_size <= 0:
+            return
+
+        expires_at: float = monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, *keys: K) -> None:
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+def clear_caches() -> None:
+    """Empty every live TTLCache, for tests that change data behind their back."""
+    for cache in list(_caches):
+        cache.clear()
+
+
+if __name__ == "__main__":
+    from time import sleep
+
+    def _test_lru_eviction():
+        cache: TTLCache[str, int] = TTLCache(max_size=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        assert cache.get("a") == 1
+        cache.set("c", 3)
+        assert cache.get("b") is MISSING
+        assert cache.get("a") == 1
+        assert cache.get("c") == 3
+        assert cache.evictions == 1
+
+    def _test_ttl_expiry():
+        cache: TTLCache[str, int] = TTLCache(max_size=2, ttl=60)
+        cache.set("a", 1, ttl=0.01)
+        cache.set("b", 2)
+        sleep(0.02)
+        assert cache.get("a") is MISSING
+        assert cache.get("b") == 2
+        assert cache.stats()["hits"] == 1
+        assert cache.stats()["misses"] == 1
+
+    _test_lru_eviction()
+    _test_ttl_expiry()
@@ -0,0 +1,88 @@
+"""Validators and precondition checks for conditional GETs (RFC 7232)."""
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from hashlib import blake2b
+from typing import Any, Dict, List, Optional
+
+from starlette.requests import Request
+
+
+def entity_tag(*parts: Any) -> str:
+    """Strong ETag for the representation identified by `parts`."""
+    digest: str = blake2b(
+        "|".join(map(str, parts)).encode(), digest_size=12
+    ).hexdigest()
+    return f'"{digest}"'
+
+
+def as_utc(moment: datetime) -> datetime:
+    # TIMESTAMP columns are naive and written in UTC
+    if moment.tzinfo is None:
+        return moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(timezone.utc)
+
+
+def http_date(moment: datetime) -> str:
+    return format_datetime(as_utc(moment).replace(microsecond=0), usegmt=True)
+
+
+def validators(etag: str, last_modified: Optional[datetime]) -> Dict[str, str]:
+    headers: Dict[str, str] = {"ETag": etag}
+    if last_modified is not None:
+        headers["Last-Modified"] = http_date(last_modified)
+    return headers
+
+
+def _etags(header: str) -> List[str]:
+    # Weak comparison, which is what If-None-Match uses
+    return [tag.strip().removeprefix("W/") for tag in header.split(",")]
+
+
+def not_modified(
+    request: Request, etag: str, last_modified: Optional[datetime]
+) -> bool:
+    """Whether a GET with these validators should be answered with 304.
+
+    If-Modified-Since is only considered when If-None-Match is absent.
+    """
+    if_none_match: Optional[str] = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags: List[str] = _etags(if_none_match)
+        return "*" in tags or etag in tags
+
+    if_modified_since: Optional[str] = request.headers.get("if-modified-since")
+    if if_modified_since is None or last_modified is None:
+        return False
+    try:
+        since: datetime = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    return as_utc(last_modified).replace(microsecond=0) <= as_utc(since)
+
+
+if __name__ == "__main__":
+    from starlette.datastructures import Headers
+
+    def _request(**headers: str) -> Request:
+        raw = [(k.replace("_", "-").encode(), v.encode()) for k, v in headers.items()]
+        return Request({"type": "http", "headers": Headers(raw=raw).raw})
+
+    def _test_not_modified():
+        etag: str = entity_tag(1, "2024-01-01")
+        modified = datetime(2024, 1, 1, 12, 0, 0, 500)
+        assert etag == entity_tag(1, "2024-01-01") != entity_tag(2, "2024-01-01")
+        assert not_modified(_request(if_none_match=f'"x", W/{etag}'), etag, modified)
+        assert not not_modified(_request(if_none_match='"x"'), etag, modified)
+        assert not_modified(_request(if_none_match="*"), etag, None)
+
+        since: str = validators(etag, modified)["Last-Modified"]
+        assert since == "Mon, 01 Jan 2024 12:00:00 GMT"
+        assert not_modified(_request(if_modified_since=since), etag, modified)
+        later = datetime(2024, 1, 1, 12, 0, 1)
+        assert not not_modified(_request(if_modified_since=since), etag, later)
+        assert not not_modified(_request(if_modified_since="garbage"), etag, later)
+        # If-None-Match wins over If-Modified-Since
+        request = _request(if_none_match='"x"', if_modified_since=since)
+        assert not not_modified(request, etag, modified)
+
+    _test_not_modified()
@@ -0,0 +1,278 @@
+"""In-process metrics rendered in the Prometheus text exposition format.
+
+Counters and histograms are sharded per thread: the event loop thread and
+each database executor thread write to their own dict without locking, and
+the shards are only summed when /metrics is scraped. Gauges are read from
+callbacks at scrape time.
+"""
+from __future__ import annotations
+
+from bisect import bisect_left
+from threading import Lock, local
+from time import perf_counter
+from typing import Any, Callable, Dict, Iterator, List, Sequence, Tuple
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+Labels = Tuple[str, ...]
+Samples = Dict[Labels, float]
+
+default_buckets: Tuple[float, ...] = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[Any]) -> str:
+    if not names:
+        return ""
+    pairs: List[str] = []
+    for name, value in zip(names, values):
+        escaped = (
+            str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        )
+        pairs.append(f'{name}="{escaped}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class Metric:
+    type: str = "untyped"
+
+    def __init__(self, name: str, help: str, label_names: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        registry.append(self)
+
+    def collect(self) -> Samples:
+        """The current value of each labelled series."""
+        return {}
+
+    def samples(self) -> Iterator[str]:
+        for labels, value in sorted(self.collect().items()):
+            yield f"{self.name}{_format_labels(self.label_names, labels)} {value}"
+
+    def render(self) -> str:
+        lines: List[str] = [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class _Sharded(Metric):
+    def __init__(self, name: str, help: str, label_names: Sequence[str] = ()) -> None:
+        super().__init__(name, help, label_names)
+        self._local = local()
+        self._shards: List[Dict[Labels, Any]] = []
+        self._lock = Lock()
+
+    def _shard(self) -> Dict[Labels, Any]:
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard: Dict[Labels, Any] = {}
+            with self._lock:
+                self._shards.append(shard)
+            self._local.shard = shard
+            return shard
+
+
+class Counter(_Sharded):
+    type = "counter"
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def totals(self) -> Samples:
+        totals: Samples = {}
+        for shard in list(self._shards):
+            for labels, value in list(shard.items()):
+                totals[labels] = totals.get(labels, 0) + value
+        return totals
+
+    def collect(self) -> Samples:
+        return self.totals()
+
+
+class Histogram(_Sharded):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        label_names: Sequence[str] = (),
+        buckets: Sequence[float] = default_buckets,
+    ) -> None:
+        super().__init__(name, help, label_names)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels: str) -> None:
+        shard = self._shard()
+        # [per bucket counts..., +Inf count, sum]
+        series: List[float] | None = shard.get(labels)
+        if series is None:
+            series = shard[labels] = [0] * (len(self.buckets) + 2)
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def samples(self) -> Iterator[str]:
+        merged: Dict[Labels, List[float]] = {}
+        for shard in list(self._shards):
+            for labels, series in list(shard.items()):
+                totals = merged.setdefault(labels, [0] * len(series))
+                for idx, value in enumerate(series):
+                    totals[idx] += value
+
+        bucket_label_names = (*self.label_names, "le")
+        for labels, series in sorted(merged.items()):
+            cumulative: float = 0
+            for bound, count in zip((*self.buckets, "+Inf"), series[:-1]):
+                cumulative += count
+                bucket_labels = _format_labels(bucket_label_names, (*labels, bound))
+                yield f"{self.name}_bucket{bucket_labels} {cumulative}"
+            label_str = _format_labels(self.label_names, labels)
+            yield f"{self.name}_sum{label_str} {series[-1]}"
+            yield f"{self.name}_count{label_str} {cumulative}"
+
+
+class Gauge(Metric):
+    """Metric whose samples are read from `collect` on every scrape."""
+
+    type = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        collect: Callable[[], Samples],
+        label_names: Sequence[str] = (),
+        type: str = "gauge",
+    ) -> None:
+        super().__init__(name, help, label_names)
+        self._collect = collect
+        self.type = type
+
+    def collect(self) -> Samples:
+        return self._collect()
+
+
+registry: List[Metric] = []
+
+
+def render() -> str:
+    return "\n".join(metric.render() for metric in registry) + "\n"
+
+
+http_request_duration = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by route",
+    ("method", "route"),
+)
+http_requests = Counter(
+    "http_requests_total",
+    "HTTP responses by route and status code",
+    ("method", "route", "status"),
+)
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency and status of every HTTP request.
+
+    Requests are labelled with the path template of the route that served
+    them rather than the raw path, so ids do not explode the label space.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+        self.routes: Dict[Callable, str] = {}
+
+    def route_label(self, scope: Scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        if endpoint not in self.routes:
+            for route in scope["app"].routes:
+                if getattr(route, "endpoint", None) is endpoint:
+                    self.routes[endpoint] = route.path
+                    break
+            else:
+                self.routes[endpoint] = getattr(endpoint, "__name__", "unknown")
+        return self.routes[endpoint]
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status: List[int] = [500]
+
+        async def send_with_status(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        started: float = perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route: str = self.route_label(scope)
+            http_request_duration.observe(
+                perf_counter() - started, scope["method"], route
+            )
+            http_requests.inc(scope["method"], route, str(status[0]))
+
+
+if __name__ == "__main__":
+    from threading import Thread
+
+    def _test_counter_shards_are_summed():
+        counter = Counter("test_total", "test counter", ("kind",))
+        threads = [
+            Thread(target=lambda: [counter.inc("a") for _ in range(1000)])
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert counter.totals() == {("a",): 4000}
+        assert 'test_total{kind="a"} 4000' in render()
+
+    def _test_histogram_render():
+        histogram = Histogram("test_seconds", "test histogram", buckets=(0.1, 1.0))
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        histogram.observe(5)
+        rendered = histogram.render()
+        assert 'test_seconds_bucket{le="0.1"} 1' in rendered
+        assert 'test_seconds_bucket{le="1.0"} 2' in rendered
+        assert 'test_seconds_bucket{le="+Inf"} 3' in rendered
+        assert "test_seconds_count 3" in rendered
+
+    def _test_gauge_render():
+        gauge = Gauge(
+            "test_items", "test gauge", lambda: {("b",): 2, ("a",): 1}, ("k",)
+        )
+        assert gauge.render().splitlines()[2:] == [
+            'test_items{k="a"} 1',
+            'test_items{k="b"} 2',
+        ]
+
+    _test_counter_shards_are_summed()
+    _test_histogram_render()
+    _test_gauge_render()
@@ -1,33 +1,266 @@
 #!/usr/bin/env python3
+"""Apply the versioned SQL migrations of each model, in order.
+
+Migrations live in `<model>/migrations/NNNN_description.sql` and are
+recorded in the schema_migrations table once applied, so running this again
+only applies what is new. Statements are separated by `;`, except within
+dollar quoted bodies such as those of DO blocks and functions.
+
+A file whose first line is `-- migrate: no-transaction` runs statement by
+statement outside a transaction, which `CREATE INDEX CONCURRENTLY` needs.
+Such statements should be idempotent (IF NOT EXISTS) since a failure half
+way through cannot be rolled back.
+
+A `-- migrate: requires-extension NAME` line at the top makes a migration
+wait until the server can install extension NAME. It is skipped, and stays
+pending, wherever the extension is not available.
+"""
 import os
+import re
 import sys
-from typing import List
+from argparse import ArgumentParser
+from dataclasses import dataclass
+from typing import Callable, List, Set, Tuple
+
+root: str = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, root)
+
+from psycopg2 import Error as DriverError
+from psycopg2.extensions import connection as Connection
+
+from database.database import Parameters, Query, connect, default_config
+
+to_migrate: List = ["users", "auth"]
+
+no_transaction: str = "-- migrate: no-transaction"
+requires_extension: str = "-- migrate: requires-extension "
+# Opening and closing tag of a dollar quoted string, $$ or $name$
+dollar_quote = re.compile(r"\$(?:[A-Za-z_][A-Za-z_0-9]*)?\$")
+# Serialises concurrent runs, e.g. several containers starting at once
+lock_id: int = 7_240_061
+
+create_schema_migrations: Query = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version VARCHAR ( 255 ) PRIMARY KEY,
+    applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+
+@dataclass
+class Migration:
+    version: str
+    statements: List[Query]
+    transactional: bool = True
+    extensions: Tuple[str, ...] = ()
+
+
+def to_statements(sql: str) -> List[Query]:
+    lines: List[str] = [
+        line for line in sql.splitlines() if not line.strip().startswith("--")
+    ]
+    text: str = "\n".join(lines)
+    statements: List[Query] = []
+    start: int = 0
+    position: int = 0
+    while position < len(text):
+        if text[position] == ";":
+            statements.append(text[start:position])
+            start = position + 1
+        elif text[position] == "$":
+            tag = dollar_quote.match(text, position)
+            if tag is not None:
+                # Skip to the closing tag, past any ; in the body
+                end: int = text.find(tag.group(), tag.end())
+                position = len(text) if end < 0 else end + len(tag.group())
+                continue
+        position += 1
+    statements.append(text[start:])
+    return [statement.strip() for statement in statements if statement.strip()]
+
+
+def required_extensions(sql: str) -> Tuple[str, ...]:
+    return tuple(
+        line[len(requires_extension) :].strip()
+        for line in sql.splitlines()
+        if line.startswith(requires_extension)
+    )
+
+
+def load_migrations(model: str) -> List[Migration]:
+    directory: str = os.path.join(root, model, "migrations")
+    migrations: List[Migration] = []
+    for filename in sorted(os.listdir(directory)):
+        if not filename.endswith(".sql"):
+            continue
+
+        with open(os.path.join(directory, filename), "r") as file:
+            sql: str = file.read()
+        migrations.append(
+            Migration(
+                version=f"{model}/{filename[:-len('.sql')]}",
+                statements=to_statements(sql),
+                transactional=not sql.startswith(no_transaction),
+                extensions=required_extensions(sql),
+            )
+        )
+    return migrations
+
+
+def applied_versions(connection: Connection) -> Set[str]:
+    with connection.cursor() as cursor:
+        cursor.execute(create_schema_migrations)
+        cursor.execute("SELECT version FROM schema_migrations")
+        return {row[0] for row in cursor.fetchall()}
+
+
+def available_extensions(connection: Connection) -> Set[str]:
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT name FROM pg_available_extensions")
+        return {row[0] for row in cursor.fetchall()}
+
+
+def pending_migrations(connection: Connection) -> List[Migration]:
+    applied: Set[str] = applied_versions(connection)
+    return [
+        migration
+        for model in to_migrate
+        for migration in load_migrations(model)
+        if migration.version not in applied
+    ]
+
+
+def apply(connection: Connection, migration: Migration) -> None:
+    connection.autocommit = not migration.transactional
+    with connection.cursor() as cursor:
+        for statement in migration.statements:
+            cursor.execute(statement)
+        cursor.execute(
+            "INSERT INTO schema_migrations (version) VALUES (%s)",
+            (migration.version,),
+        )
+    if migration.transactional:
+        connection.commit()
+    connection.autocommit = True
+
+
+def service_queries() -> List[Tuple[str, Query, Parameters]]:
+    """The hot service queries, with representative parameters, to EXPLAIN."""
+    from users.service import (
+        list_columns,
+        search_params,
+        search_users_query,
+        select_user_by_email_query,
+        select_user_by_id_query,
+        select_users_query,
+        select_users_version_query,
+        table_name,
+    )
+
+    table: str = table_name()
+    return [
+        (
+            "get_users",
+            select_users_query(table, limited=True, columns=list_columns),
+            (100,),
+        ),
+        (
+            "get_users (next page)",
+            select_users_query(table, keyset=True, limited=True, columns=list_columns),
+            ("2100-01-01T00:00:00", 2**31 - 1, 100),
+        ),
+        (
+            "get_user_by_email",
+            select_user_by_email_query(table),
+            ("nobody@example.com",),
+        ),
+        ("get_user_by_id", select_user_by_id_query(table), (1,)),
+        ("get_users_version", select_users_version_query(table), ()),
+        (
+            "search_users (prefix)",
+            search_users_query(table),
+            search_params("wen", False, None, 21),
+        ),
+        (
+            "search_users (fuzzy)",
+            search_users_query(table, fuzzy=True),
+            search_params("wenceslao", True, None, 21),
+        ),
+    ]
+
 
-sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+def explain(connection: Connection, title: str) -> None:
+    print(f"\n=== EXPLAIN {title}")
+    with connection.cursor() as cursor:
+        for name, query, params in service_queries():
+            print(f"\n--- {name}")
+            cursor.execute("SAVEPOINT explain")
+            try:
+                cursor.execute(f"EXPLAIN {query}", params)
+                print("\n".join(row[0] for row in cursor.fetchall()))
+                cursor.execute("RELEASE SAVEPOINT explain")
+            except DriverError as err:
+                cursor.execute("ROLLBACK TO SAVEPOINT explain")
+                print(f"(not available: {str(err).strip()})")
 
-from database.database import connect, default_config
 
-to_migrate: List = ["users"]
+def dry_run(connection: Connection, pending: List[Migration]) -> None:
+    """Print the plans of the service queries before and after `pending`.
 
+    The migrations are applied inside a transaction that is rolled back, with
+    CONCURRENTLY dropped since it is not allowed in a transaction block.
+    """
+    connection.autocommit = False
+    explain(connection, "before")
+    with connection.cursor() as cursor:
+        for migration in pending:
+            for statement in migration.statements:
+                cursor.execute(statement.replace(" CONCURRENTLY", ""))
+    explain(connection, "after")
+    connection.rollback()
+    connection.autocommit = True
 
-def to_query_str(model: str) -> str:
-    query: str
-    with open(f"./{model}/{model}.sql", "r") as file:
-        query = file.read().replace("\n", "")
-    return query
 
+def migrate(dry: bool = False, log: Callable[[str], None] = print) -> List[str]:
+    connection: Connection = connect(default_config)
+    connection.autocommit = True
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_lock(%s)", (lock_id,))
 
-def create_table():
-    connection = connect(default_config)
-    cursor = connection.cursor()
-    for model in to_migrate:
-        cursor.execute(to_query_str(model))
-    connection.commit()
+        available: Set[str] = available_extensions(connection)
+        pending: List[Migration] = []
+        for migration in pending_migrations(connection):
+            missing: List[str] = [
+                name for name in migration.extensions if name not in available
+            ]
+            if missing:
+                log(f"Skipping {migration.version}, needs {', '.join(missing)}")
+            else:
+                pending.append(migration)
+        if not pending:
+            log("Nothing to migrate")
+            return []
 
+        for migration in pending:
+            log(f"{'Would apply' if dry else 'Applying'} {migration.version}")
+        if dry:
+            dry_run(connection, pending)
+            return [migration.version for migration in pending]
 
-def migrate():
-    pass
+        for migration in pending:
+            apply(connection, migration)
+        return [migration.version for migration in pending]
+    finally:
+        connection.close()
 
 
 if __name__ == "__main__":
-    create_table()
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="list pending migrations and EXPLAIN the service queries around them",
+    )
+    args = parser.parse_args()
+    migrate(dry=args.dry_run)
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""Run the tests in the `__main__` block of every module, in parallel.
+
+Each module runs in its own process, which gets its own test schema (see
+utils/test_server.py), so they do not interfere with each other.
+
+    python utils/run_tests.py [--workers N] [module ...]
+"""
+import os
+import sys
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from subprocess import PIPE, STDOUT, run
+from time import perf_counter
+from typing import List, Tuple
+
+root: str = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+test_modules: List[str] = [
+    "utils.cache",
+    "utils.metrics",
+    "utils.batch",
+    "utils.singleflight",
+    "utils.conditional",
+    "database.replicas",
+    "users.service",
+    "users.archive",
+    "users.router",
+    "auth.service",
+]
+
+
+def run_module(module: str) -> Tuple[str, int, float, str]:
+    started: float = perf_counter()
+    result = run(
+        [sys.executable, "-m", module], cwd=root, stdout=PIPE, stderr=STDOUT, text=True
+    )
+    return module, result.returncode, perf_counter() - started, result.stdout
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("modules", nargs="*", default=test_modules)
+    args = parser.parse_args()
+
+    started: float = perf_counter()
+    failed: List[str] = []
+    with ThreadPoolExecutor(args.workers) as pool:
+        for module, code, elapsed, output in pool.map(run_module, args.modules):
+            print(f"{'ok' if code == 0 else 'FAILED':>6}  {module}  {elapsed:.2f}s")
+            if code != 0:
+                failed.append(module)
+                print(output)
+
+    print(f"{len(args.modules) - len(failed)} passed, {len(failed)} failed")
+    print(f"in {perf_counter() - started:.2f}s")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+from asyncio import AbstractEventLoop, Task, get_running_loop, shield
+from functools import partial
+from typing import Awaitable, Callable, Dict, Hashable, Tuple, TypeVar
+from weakref import WeakKeyDictionary
+
+from utils.metrics import Counter
+
+T = TypeVar("T")
+
+Key = Tuple[str, Hashable]
+
+singleflight_calls = Counter(
+    "singleflight_calls_total",
+    "Calls that ran because no identical call was in flight",
+    ("call",),
+)
+singleflight_collapsed = Counter(
+    "singleflight_collapsed_total",
+    "Calls answered by an identical call already in flight",
+    ("call",),
+)
+
+
+class SingleFlight:
+    """Share one in-flight call among concurrent callers asking for the same key.
+
+    The call runs as its own task, so a caller that is cancelled does not
+    cancel it for the others. Every caller gets the same result object, which
+    they must not mutate.
+    """
+
+    def __init__(self) -> None:
+        self._calls: WeakKeyDictionary[
+            AbstractEventLoop, Dict[Key, Task]
+        ] = WeakKeyDictionary()
+
+    async def do(self, name: str, key: Hashable, call: Callable[[], Awaitable[T]]) -> T:
+        loop: AbstractEventLoop = get_running_loop()
+        calls: Dict[Key, Task] = self._calls.setdefault(loop, {})
+        task: Task | None = calls.get((name, key))
+        if task is None:
+            singleflight_calls.inc(name)
+            task = calls[(name, key)] = loop.create_task(call())
+            task.add_done_callback(partial(self._forget, calls, (name, key)))
+        else:
+            singleflight_collapsed.inc(name)
+        return await shield(task)
+
+    @staticmethod
+    def _forget(calls: Dict[Key, Task], key: Key, task: Task) -> None:
+        if calls.get(key) is task:
+            del calls[key]
+        if not task.cancelled():
+            # Mark the exception retrieved in case every caller was cancelled
+            task.exception()
+
+
+if __name__ == "__main__":
+    from asyncio import gather, run, sleep
+
+    def _test_identical_calls_are_collapsed():
+        calls: Dict[int, int] = {}
+
+        async def double(value: int) -> int:
+            calls[value] = calls.get(value, 0) + 1
+            await sleep(0.01)
+            if value < 0:
+                raise ValueError(value)
+            return value * 2
+
+        async def main() -> None:
+            flight = SingleFlight()
+            results = await gather(
+                *(
+                    flight.do("double", value, partial(double, value))
+                    for value in (1, 1, 2, -1, -1)
+                ),
+                return_exceptions=True,
+            )
+            assert results[:3] == [2, 2, 4]
+            assert all(isinstance(result, ValueError) for result in results[3:])
+            assert calls == {1: 1, 2: 1, -1: 1}
+            assert singleflight_collapsed.totals()[("double",)] == 2
+
+            assert await flight.do("double", 1, partial(double, 1)) == 2
+            assert calls[1] == 2
+
+        run(main())
+
+    _test_identical_calls_are_collapsed()
@@ -1,78 +1,131 @@
-from multiprocessing import Process
-from os import getcwd
-from typing import Any, Callable
-
-import requests
-
+"""Fixtures for the tests in each module's `__main__` block.
+
+Every test process gets its own schema, created once with the test tables of
+every model, so processes can run side by side without sharing rows. Each
+test then runs inside one transaction on one connection: the model's seed
+rows are inserted, the test runs, and everything is rolled back.
+
+The application reaches that connection through TransactionalPool, which
+replaces the default pool for the duration of a test, and routers are
+driven in process through an ASGI test client rather than a live server.
+"""
+import atexit
+from contextlib import contextmanager
+from functools import lru_cache, wraps
+from os import getcwd, getpid
+from threading import Lock
+from typing import Any, Callable, Iterator
+
+from fastapi import APIRouter, FastAPI
+from fastapi.testclient import TestClient
+from psycopg2.extensions import connection as Connection
+
+import database.database as database
 from database.database import connect, default_config
+from utils.cache import clear_caches
 
 Decorator = Callable[[Callable], Any]
 
+test_models = ("users", "auth")
+
 
 def __get_query(filename: str) -> str:
     query: str
     with open(filename, "r") as file:
-        query = file.read().replace("\n", "")
+        query = file.read().replace("\n", " ")
     return query
 
 
-def test_create_data(model: str) -> Decorator:
-    directory: str = f"{getcwd()}/{model}"
+class TransactionalPool:
+    """Pool stand-in that lends out a single connection, one borrower at a time.
 
-    def __decorator(func) -> Callable:
-        def __fn():
-            insert_query: str = __get_query(f"{directory}/insert_test.sql")
-            create_table_query: str = __get_query(f"{directory}/create_test_table.sql")
-            connection = connect(default_config)
-            cursor = connection.cursor()
+    Each checkout runs under a savepoint, which takes the place of the commit
+    or rollback a real pool would do, so errors stay contained and nothing is
+    committed. The lock is not owned by a thread because a streaming query
+    may be finished from a different executor thread than the one it started.
+    """
 
-            cursor.execute(create_table_query)
-            connection.commit()
-            cursor.execute(insert_query)
-            connection.commit()
-            return func()
+    def __init__(self, connection: Connection) -> None:
+        self._connection = connection
+        self._lock = Lock()
 
-        return __fn
-
-    return __decorator
+    @property
+    def idle(self) -> int:
+        return 0 if self._lock.locked() else 1
 
+    @property
+    def in_use(self) -> int:
+        return 1 - self.idle
 
-def test_delete_data(model: str) -> Decorator:
-    directory: str = f"{getcwd()}/{model}"
-
-    def __decorator(func) -> Callable:
+    @contextmanager
+    def connection(self) -> Iterator[Connection]:
+        with self._lock:
+            with self._connection.cursor() as cursor:
+                cursor.execute("SAVEPOINT checkout")
+            try:
+                yield self._connection
+            except BaseException:
+                with self._connection.cursor() as cursor:
+                    cursor.execute("ROLLBACK TO SAVEPOINT checkout")
+                raise
+            finally:
+                with self._connection.cursor() as cursor:
+                    cursor.execute("RELEASE SAVEPOINT checkout")
+
+
+@lru_cache(maxsize=None)
+def test_connection() -> Connection:
+    """Connection of this process, with the test schema as its search path."""
+    connection: Connection = connect(default_config)
+    schema: str = f"test_{getpid()}"
+    with connection.cursor() as cursor:
+        cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {schema}")
+        # public stays on the path for extensions such as pg_trgm installed there
+        cursor.execute(f"SET search_path TO {schema}, public")
+        for model in test_models:
+            cursor.execute(__get_query(f"{getcwd()}/{model}/create_test_table.sql"))
+    connection.commit()
+
+    def drop_schema() -> None:
+        connection.rollback()
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP SCHEMA {schema} CASCADE")
+        connection.commit()
+        connection.close()
+
+    atexit.register(drop_schema)
+    return connection
+
+
+def transactional(*models: str) -> Decorator:
+    """Run the test in a transaction seeded with the rows of `models`."""
+
+    def __decorator(func: Callable) -> Callable:
+        @wraps(func)
         def __fn():
+            connection: Connection = test_connection()
+            default_pool = database.default_pool
+            database.default_pool = TransactionalPool(connection)
+            clear_caches()
             try:
-                func()
+                with connection.cursor() as cursor:
+                    for model in models:
+                        cursor.execute(
+                            __get_query(f"{getcwd()}/{model}/insert_test.sql")
+                        )
+                return func()
             finally:
-                delete_query: str = __get_query(f"{directory}/delete_test.sql")
-                connection = connect(default_config)
-                cursor = connection.cursor()
-                cursor.execute(delete_query)
-                connection.commit()
-            return
+                database.default_pool = default_pool
+                connection.rollback()
+                clear_caches()
 
         return __fn
 
     return __decorator
 
 
-def test_router(func):
-    def __decorator():
-        internal_proc = Process(target=func, args=(), daemon=False)
-        internal_proc.start()
-        internal_proc.join(0.25)
-
-    return __decorator
-
-
-def wait_for_server(func):
-    def __decorator():
-        while True:
-            try:
-                func()
-                return
-            except requests.exceptions.ConnectionError:
-                continue
-
-    return __decorator
+def test_client(router: APIRouter) -> TestClient:
+    """In process client for an app serving `router`."""
+    app = FastAPI()
+    app.include_router(router)
+    return TestClient(app)